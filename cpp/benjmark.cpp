@@ -1,8 +1,102 @@
 #include "benjmark.h"
 #include <fstream>
+#include <vector>
+#include <cstdint>
+#include <cstring>
+#include <sys/stat.h>
 
 namespace bj {
+  namespace {
+    // The binary companion of a problem file, problemNNNN.bin, written by
+    // plots/benjbin.py: A magic string, the length of a JSON header, the
+    // header, and raw little-endian float64 arrays that the header refers
+    // to as {"bj-array": i}. Reading it skips parsing the decimal text of
+    // the large arrays.
+    const char binaryMagic[] = "BJPROB01";
+
+    std::string binaryFilename(const std::string& filename) {
+      auto dot = filename.rfind('.');
+      auto slash = filename.rfind('/');
+      if (dot == std::string::npos || (slash != std::string::npos && dot < slash)) {
+        return filename + ".bin";
+      }
+      return filename.substr(0, dot) + ".bin";
+    }
+
+    bool isCurrent(const std::string& filename, const std::string& binary) {
+      struct stat src, dst;
+      if (stat(filename.c_str(), &src) != 0 || stat(binary.c_str(), &dst) != 0) {
+        return false;
+      }
+      // In nanoseconds, as st_mtime_ns in is_current of plots/benjbin.py
+      return src.st_mtim.tv_sec < dst.st_mtim.tv_sec ||
+        (src.st_mtim.tv_sec == dst.st_mtim.tv_sec && src.st_mtim.tv_nsec <= dst.st_mtim.tv_nsec);
+    }
+
+    nlohmann::json shapedArray(const double* data, const std::vector<size_t>& shape, size_t dim) {
+      nlohmann::json dst = nlohmann::json::array();
+      if (dim + 1 == shape.size()) {
+        for (size_t i = 0; i < shape[dim]; i++) {
+          dst.push_back(data[i]);
+        }
+        return dst;
+      }
+      size_t stride = 1;
+      for (size_t d = dim + 1; d < shape.size(); d++) {
+        stride *= shape[d];
+      }
+      for (size_t i = 0; i < shape[dim]; i++) {
+        dst.push_back(shapedArray(data + i*stride, shape, dim + 1));
+      }
+      return dst;
+    }
+
+    nlohmann::json readArray(std::ifstream& file, const nlohmann::json& info) {
+      std::vector<size_t> shape = info["shape"];
+      size_t count = 1;
+      for (auto n: shape) {
+        count *= n;
+      }
+      std::vector<double> data(count);
+      file.seekg(info["offset"].get<uint64_t>());
+      file.read(reinterpret_cast<char*>(data.data()), count*sizeof(double));
+      return shapedArray(data.data(), shape, 0);
+    }
+
+    void joinArrays(nlohmann::json& value, std::ifstream& file, const nlohmann::json& arrays) {
+      if (value.is_object() && value.count("bj-array")) {
+        value = readArray(file, arrays[value["bj-array"].get<size_t>()]);
+      } else if (value.is_structured()) {
+        for (auto& x: value) {
+          joinArrays(x, file, arrays);
+        }
+      }
+    }
+
+    nlohmann::json readBinary(const std::string& filename) {
+      std::ifstream file(filename, std::ios::binary);
+      char magic[8];
+      file.read(magic, 8);
+      if (std::memcmp(magic, binaryMagic, 8) != 0) {
+        throw std::runtime_error("Not a binary problem file: " + filename);
+      }
+      uint64_t n = 0;
+      file.read(reinterpret_cast<char*>(&n), 8);
+      std::string header(n, '\0');
+      file.read(&header[0], n);
+      nlohmann::json j = nlohmann::json::parse(header);
+      nlohmann::json arrays = j["arrays"];
+      j.erase("arrays");
+      joinArrays(j, file, arrays);
+      return j;
+    }
+  }
+
   nlohmann::json readJson(const std::string& filename) {
+    auto binary = binaryFilename(filename);
+    if (isCurrent(filename, binary)) {
+      return readBinary(binary);
+    }
     std::ifstream file(filename);
     nlohmann::json j;
     file >> j;
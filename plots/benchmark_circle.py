@@ -1,12 +1,23 @@
+import sys
 import benjmark
+import plotbuild
+import figureoutput
 
-keys = ["cpp", "geex", "java", "clojure"];
+plotbuild.init(sys.argv);
+
+keys = ["cpp", "geex", "java", "clojure", "numpy"];
 #keys = ["geex", "java"];
 
 circle_root = "../benchmarks/circle";
+keys = benjmark.available_keys(keys, circle_root);
+
+circle_settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/circle').set('sizeformat', '{:d} points').set('xlabel', 'Number of points').set('ylabel', 'Computation time (seconds)').update(figureoutput.flags(sys.argv));
 
-circle_settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/circle').set('sizeformat', '{:d} points').set('xlabel', 'Number of points').set('ylabel', 'Computation time (seconds)');
+inputs = benjmark.root_files(circle_root);
+values = [keys, circle_settings, [p['size'] for p in benjmark.load_problems(circle_root)]];
 
-benjmark.render_barplots(keys, circle_root, circle_settings);
+plotbuild.step('circle-bars', lambda: benjmark.render_barplots(keys, circle_root, circle_settings),
+               inputs, values, [benjmark.__file__]);
 
-benjmark.render_lineplot(keys, circle_root, circle_settings);
+plotbuild.step('circle-lineplot', lambda: benjmark.render_lineplot(keys, circle_root, circle_settings),
+               inputs, values, [benjmark.__file__]);
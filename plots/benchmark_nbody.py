@@ -1,12 +1,23 @@
+import sys
 import benjmark
+import plotbuild
+import figureoutput
 
-keys = ["cpp", "geex", "java", "clojure"];
+plotbuild.init(sys.argv);
+
+keys = ["cpp", "geex", "java", "clojure", "numpy"];
 #keys = ["geex", "java"];
 #keys = ["cpp", ""java", "clojure"];
 
 root = "../benchmarks/nbody";
+keys = benjmark.available_keys(keys, root);
+
+settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/nbody').set('sizeformat', '{:d} iterations').set('xlabel', 'Number of iterations').set('logy', False).set('logx', False).update(figureoutput.flags(sys.argv));
 
-settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/nbody').set('sizeformat', '{:d} iterations').set('xlabel', 'Number of iterations').set('logy', False).set('logx', False);
+inputs = benjmark.root_files(root);
+values = [keys, settings, [p['size'] for p in benjmark.load_problems(root)]];
 
-benjmark.render_barplots(keys, root, settings);
-benjmark.render_lineplot(keys, root, settings);
+plotbuild.step('nbody-bars', lambda: benjmark.render_barplots(keys, root, settings),
+               inputs, values, [benjmark.__file__]);
+plotbuild.step('nbody-lineplot', lambda: benjmark.render_lineplot(keys, root, settings),
+               inputs, values, [benjmark.__file__]);
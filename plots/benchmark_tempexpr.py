@@ -1,13 +1,24 @@
+import sys
 import benjmark
+import plotbuild
+import figureoutput
 
-keys = ["cpp", "geex", "java", "clojure"];
+plotbuild.init(sys.argv);
+
+keys = ["cpp", "geex", "java", "clojure", "numpy", "numpy-fused"];
 #keys = ["geex", "java"];
 #keys = ["cpp", ""java", "clojure"];
 #keys = ["cpp", "geex", "clojure"];
 
 root = "../benchmarks/tempexpr";
+keys = benjmark.available_keys(keys, root);
+
+settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/tempexpr').set('sizeformat', '{:d} points').set('xlabel', 'Number of vectors').set('logy', True).set('logx', True).update(figureoutput.flags(sys.argv));
 
-settings = benjmark.default_settings.set('outputprefix', '../latex/images/benchmarks/tempexpr').set('sizeformat', '{:d} points').set('xlabel', 'Number of vectors').set('logy', True).set('logx', True);
+inputs = benjmark.root_files(root);
+values = [keys, settings, [p['size'] for p in benjmark.load_problems(root)]];
 
-benjmark.render_barplots(keys, root, settings);
-benjmark.render_lineplot(keys, root, settings);
+plotbuild.step('tempexpr-bars', lambda: benjmark.render_barplots(keys, root, settings),
+               inputs, values, [benjmark.__file__]);
+plotbuild.step('tempexpr-lineplot', lambda: benjmark.render_lineplot(keys, root, settings),
+               inputs, values, [benjmark.__file__]);
@@ -0,0 +1,236 @@
+import benjmark
+import json
+import os
+import sys
+import time
+import struct
+import numpy as np
+
+# Binary companions of the problem files. problemNNNN.bin holds the same
+# problem as problemNNNN.json, with the large arrays of numbers stored as
+# raw little-endian float64 values that can be memory-mapped, instead of
+# decimal text. The layout is
+#
+#   8 bytes   magic, b'BJPROB01'
+#   8 bytes   length of the header, unsigned little-endian
+#   header    UTF-8 JSON: The problem JSON, where every stored array is
+#             replaced by {"bj-array": i}, and 'arrays', the 'offset' in
+#             bytes from the start of the file and 'shape' of array i
+#   arrays    Each starting at a multiple of 'alignment' bytes
+#
+# The loaders (benjmark.load_problem, python/bj.py and bj::readJson in
+# cpp/benjmark.cpp) use the binary file when it is at least as new as
+# the JSON file. python/bj.py has copies of magic, binary_filename,
+# read_header, join_arrays, load_problem and is_current, so that the
+# candidates do not depend on the plot scripts; a change to any of them
+# must be made to both copies.
+#
+# Usage:
+#   python3 benjbin.py convert ../benchmarks/tempexpr
+#   python3 benjbin.py compare ../benchmarks/tempexpr --problems 14
+
+magic = b'BJPROB01';
+alignment = 64;
+
+# Lists with fewer numbers than this are kept in the header
+min_elements = 1024;
+
+def binary_filename(json_filename):
+    return os.path.splitext(json_filename)[0] + '.bin';
+
+def numeric_shape(value):
+    if isinstance(value, list):
+        if len(value) == 0:
+            return None;
+        shapes = [numeric_shape(x) for x in value];
+        if shapes[0] == None or any(s != shapes[0] for s in shapes):
+            return None;
+        return (len(value),) + shapes[0];
+    if isinstance(value, (int, float)) and not(isinstance(value, bool)):
+        return ();
+    return None;
+
+def is_stored(value):
+    shape = numeric_shape(value);
+    return shape != None and 0 < len(shape) and min_elements <= np.prod(shape);
+
+# The header with the stored arrays replaced by references, and the arrays
+def split_arrays(value, arrays):
+    if is_stored(value):
+        arrays.append(np.asarray(value, dtype='<f8'));
+        return {'bj-array': len(arrays) - 1};
+    if isinstance(value, dict):
+        return {k: split_arrays(v, arrays) for k, v in value.items()};
+    if isinstance(value, list):
+        return [split_arrays(v, arrays) for v in value];
+    return value;
+
+def align(n):
+    return (n + alignment - 1)//alignment*alignment;
+
+def layout(problem, arrays):
+    # The offsets depend on the length of the header, which depends on the
+    # offsets, so the header is sized until it no longer grows.
+    offsets = [0]*len(arrays);
+    while True:
+        header = dict(problem, arrays=[{'offset': o, 'shape': list(a.shape)}
+                                       for o, a in zip(offsets, arrays)]);
+        encoded = json.dumps(header).encode('utf-8');
+        position = align(len(magic) + 8 + len(encoded));
+        new_offsets = [];
+        for a in arrays:
+            new_offsets.append(position);
+            position = align(position + a.nbytes);
+        if new_offsets == offsets:
+            return (encoded, offsets);
+        offsets = new_offsets;
+
+def write_problem(filename, problem):
+    arrays = [];
+    stripped = split_arrays(problem, arrays);
+    header, offsets = layout(stripped, arrays);
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(magic);
+        f.write(struct.pack('<Q', len(header)));
+        f.write(header);
+        for offset, a in zip(offsets, arrays):
+            f.write(b'\0'*(offset - f.tell()));
+            f.write(a.tobytes());
+    os.replace(filename + '.tmp', filename);
+    return len(arrays);
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('Not a binary problem file: ' + filename);
+        (n,) = struct.unpack('<Q', f.read(8));
+        return json.loads(f.read(n).decode('utf-8'));
+
+def join_arrays(value, arrays):
+    if isinstance(value, dict):
+        if 'bj-array' in value:
+            return arrays[value['bj-array']];
+        return {k: join_arrays(v, arrays) for k, v in value.items()};
+    if isinstance(value, list):
+        return [join_arrays(v, arrays) for v in value];
+    return value;
+
+# The problem, with its arrays as read-only NumPy arrays mapped from the file
+def load_problem(filename):
+    header = read_header(filename);
+    arrays = [np.memmap(filename, dtype='<f8', mode='r', offset=a['offset'], shape=tuple(a['shape']))
+              for a in header.pop('arrays')];
+    return join_arrays(header, arrays);
+
+def is_current(json_filename):
+    filename = binary_filename(json_filename);
+    # In nanoseconds, as isCurrent in cpp/benjmark.cpp, so that all loaders
+    # agree when the two files are written within the same second
+    return (os.path.exists(filename) and
+            os.stat(json_filename).st_mtime_ns <= os.stat(filename).st_mtime_ns);
+
+# Write the binary companion of every problem of a root that lacks a
+# current one, returning the names of the files written
+def convert_root(root):
+    dst = [];
+    for p in benjmark.load_problems(root):
+        src = root + "/" + benjmark.problem_filename(p['index']);
+        if not(is_current(src)):
+            write_problem(binary_filename(src), benjmark.load_json_data(src));
+            dst.append(binary_filename(src));
+    return dst;
+
+###################################### Comparison
+
+def collect_arrays(value, arrays):
+    if isinstance(value, np.ndarray):
+        arrays.append(value);
+    elif isinstance(value, dict):
+        for v in value.values():
+            collect_arrays(v, arrays);
+    elif isinstance(value, list):
+        for v in value:
+            collect_arrays(v, arrays);
+
+# Load a problem the way a candidate would, with every stored array as a
+# NumPy array that is read once, in a fresh process of its own
+def measure(mode, filename):
+    import resource
+    start = time.perf_counter();
+    arrays = [];
+    if mode == 'json':
+        split_arrays(benjmark.load_json_data(filename), arrays);
+    else:
+        collect_arrays(load_problem(binary_filename(filename)), arrays);
+    total = sum(float(a.sum()) for a in arrays);
+    seconds = time.perf_counter() - start;
+    return {'seconds': seconds,
+            'max-rss-kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'checksum': total};
+
+def measure_in_process(mode, filename):
+    import subprocess
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', mode, filename],
+                         stdout=subprocess.PIPE, check=True).stdout;
+    return json.loads(out);
+
+def compare(root, indices):
+    rows = [];
+    for i in indices:
+        filename = root + "/" + benjmark.problem_filename(i);
+        if not(is_current(filename)):
+            write_problem(binary_filename(filename), benjmark.load_json_data(filename));
+        m = {mode: measure_in_process(mode, filename) for mode in ['json', 'bin']};
+        rows.append({'problem': i,
+                     'json-bytes': os.path.getsize(filename),
+                     'bin-bytes': os.path.getsize(binary_filename(filename)),
+                     'json': m['json'],
+                     'bin': m['bin']});
+    return rows;
+
+def format_comparison(rows):
+    lines = ['{:>8s} {:>12s} {:>12s} {:>10s} {:>10s} {:>12s} {:>12s}'.format(
+        'problem', 'json bytes', 'bin bytes', 'json s', 'bin s', 'json RSS KiB', 'bin RSS KiB')];
+    for r in rows:
+        lines.append('{:>8d} {:>12d} {:>12d} {:>10.4f} {:>10.4f} {:>12d} {:>12d}'.format(
+            r['problem'], r['json-bytes'], r['bin-bytes'], r['json']['seconds'], r['bin']['seconds'],
+            r['json']['max-rss-kib'], r['bin']['max-rss-kib']));
+    return '\n'.join(lines) + '\n';
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjbin',
+        description='Convert the problems of a benchmark root to memory-mappable binary files, '
+        'and compare their load time and memory use with the JSON files.');
+    sub = parser.add_subparsers(dest='command', required=True);
+    convert_parser = sub.add_parser('convert');
+    convert_parser.add_argument('root');
+    compare_parser = sub.add_parser('compare');
+    compare_parser.add_argument('root');
+    compare_parser.add_argument('--problems', help='Comma-separated problem indices (default: the largest)');
+    compare_parser.add_argument('--report', help='Write the comparison as JSON to this file');
+    measure_parser = sub.add_parser('measure');
+    measure_parser.add_argument('mode', choices=['json', 'bin']);
+    measure_parser.add_argument('filename');
+    args = parser.parse_args(argv);
+
+    if args.command == 'convert':
+        for filename in convert_root(args.root):
+            sys.stdout.write(filename + '\n');
+    elif args.command == 'compare':
+        problems = benjmark.load_problems(args.root);
+        indices = [max(problems, key=lambda p: p['size'])['index']];
+        if args.problems != None:
+            indices = [int(i) for i in args.problems.split(',')];
+        rows = compare(args.root, indices);
+        sys.stdout.write(format_comparison(rows));
+        if args.report != None:
+            with open(args.report, 'w') as f:
+                json.dump(rows, f, indent=1);
+    else:
+        json.dump(measure(args.mode, args.filename), sys.stdout);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,255 @@
+import benjmark
+import figureoutput
+import pyrsistent as pyr
+import numpy as np
+import datetime
+import sqlite3
+import socket
+import os
+import sys
+
+# A history of benchmark results across runs, in a SQLite database. Every
+# ingested root becomes a run of its benchmark, with the host and time it
+# ran on. The same results.json is only ingested once per benchmark.
+#
+# The timings of a candidate on a problem in a run are stored in a single
+# row, as an array of little-endian float64 'samples' together with their
+# median, so that the number of rows grows with the number of groups
+# rather than the number of timings.
+#
+# Example:
+#   python3 benjdb.py ingest history.db ../benchmarks/circle
+#   python3 benjdb.py plot history.db circle --keys geex,java --last 20
+#   python3 benjdb.py trend history.db circle --keys geex,java
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    benchmark TEXT NOT NULL,
+    root TEXT NOT NULL,
+    host TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    sha1 TEXT NOT NULL,
+    UNIQUE (benchmark, sha1));
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (benchmark, timestamp);
+CREATE INDEX IF NOT EXISTS runs_by_host ON runs (host, timestamp);
+CREATE TABLE IF NOT EXISTS candidates (
+    id INTEGER PRIMARY KEY,
+    benchmark TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (benchmark, key));
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    cand_id INTEGER NOT NULL,
+    problem_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    median REAL NOT NULL,
+    samples BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run_id, cand_id, size);
+CREATE INDEX IF NOT EXISTS results_by_size ON results (cand_id, size);
+''';
+
+def connect(filename):
+    conn = sqlite3.connect(filename);
+    conn.execute('PRAGMA journal_mode=WAL');
+    conn.execute('PRAGMA synchronous=NORMAL');
+    conn.executescript(schema);
+    return conn;
+
+def candidate_ids(conn, benchmark, candidates):
+    conn.executemany('INSERT INTO candidates (benchmark, key, name) VALUES (?, ?, ?) '
+                     'ON CONFLICT (benchmark, key) DO UPDATE SET name = excluded.name',
+                     [(benchmark, k, c.get('name', k)) for k, c in candidates.items()]);
+    return dict(conn.execute('SELECT key, id FROM candidates WHERE benchmark = ?', (benchmark,)));
+
+# Add the results of a root as a new run. The benchmark defaults to the name
+# of the root directory and the timestamp to the time results.json was
+# written. Returns the id of the run, or None if it was already ingested.
+def ingest(conn, root, benchmark=None, host=None, timestamp=None):
+    results_file = root + '/results.json';
+    if benchmark == None:
+        benchmark = os.path.basename(os.path.normpath(root));
+    if host == None:
+        host = socket.gethostname();
+    if timestamp == None:
+        timestamp = os.path.getmtime(results_file);
+    sha1 = benjmark.file_hash(results_file);
+    loaded = benjmark.load_root(root);
+    table = loaded['table'];
+    with conn:
+        cursor = conn.execute('INSERT OR IGNORE INTO runs (benchmark, root, host, timestamp, sha1) '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (benchmark, os.path.abspath(root), host, timestamp, sha1));
+        if cursor.rowcount == 0:
+            return None;
+        run_id = cursor.lastrowid;
+        ids = candidate_ids(conn, benchmark, loaded['candidates']);
+        codes = np.array([ids[k] for k in table['cand-keys']], dtype=np.int64);
+        conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         ((run_id, c, p, s, len(t), m, t.astype('<f8').tobytes())
+                          for c, p, s, t, m in result_groups(table, codes)));
+    return run_id;
+
+# The timings of the table grouped by candidate and problem, as
+# (candidate id, problem index, size, times, median)
+def result_groups(table, codes):
+    code = table['cand-code'];
+    problem = table['problem-index'];
+    order = np.lexsort((problem, code));
+    boundaries = np.flatnonzero((np.diff(code[order]) != 0) | (np.diff(problem[order]) != 0)) + 1;
+    for rows in np.split(order, boundaries):
+        if len(rows) == 0:
+            continue;
+        t = table['time-seconds'][rows];
+        yield (int(codes[code[rows[0]]]), int(problem[rows[0]]), int(table['size'][rows[0]]),
+               t, float(np.median(t)));
+
+# The ids of the runs of a benchmark, the 'last' most recent ones if given,
+# as an SQL subquery and its parameters
+def run_selection(benchmark, last=None, host=None):
+    sql = 'SELECT id FROM runs WHERE benchmark = ?';
+    params = [benchmark];
+    if host != None:
+        sql += ' AND host = ?';
+        params.append(host);
+    if last != None:
+        sql += ' ORDER BY timestamp DESC LIMIT ?';
+        params.append(last);
+    return (sql, params);
+
+def load_candidates(conn, benchmark, keys=None):
+    rows = conn.execute('SELECT id, key, name FROM candidates WHERE benchmark = ?', (benchmark,));
+    return {key: {'id': i, 'name': name} for i, key, name in rows
+            if keys == None or key in keys};
+
+def fetch_columns(conn, sql, params, dtypes):
+    rows = conn.execute(sql, params).fetchall();
+    if len(rows) == 0:
+        return [np.empty(0, dtype=t) for t in dtypes];
+    return [np.array(c, dtype=t) for c, t in zip(zip(*rows), dtypes)];
+
+# The candidate ids, sizes and times of the selected rows, one per timing
+def fetch_samples(conn, sql, params):
+    rows = conn.execute(sql, params).fetchall();
+    if len(rows) == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0));
+    cand_id, size, count, samples = zip(*rows);
+    count = np.array(count, dtype=np.int64);
+    return (np.repeat(np.array(cand_id, dtype=np.int64), count),
+            np.repeat(np.array(size, dtype=np.int64), count),
+            np.frombuffer(b''.join(samples), dtype='<f8').astype(np.float64));
+
+def candidate_filter(candidates):
+    return ' AND cand_id IN ({:s})'.format(','.join(str(c['id']) for c in candidates.values()));
+
+# The results of the selected runs as a loaded root, that can be passed to
+# benjmark.render_lineplot and benjmark.render_barplots in place of a root
+# directory. Problems are identified by their size, and the timings of all
+# runs are pooled.
+def query(conn, benchmark, keys=None, last=None, host=None):
+    candidates = load_candidates(conn, benchmark, keys);
+    runs, params = run_selection(benchmark, last, host);
+    cand_id, size, time_seconds = fetch_samples(
+        conn,
+        'SELECT cand_id, size, count, samples FROM results WHERE run_id IN (' + runs + ')'
+        + candidate_filter(candidates),
+        params);
+    sizes = np.unique(size);
+    cand_keys = sorted(candidates, key=lambda k: candidates[k]['id']);
+    ids = np.array([candidates[k]['id'] for k in cand_keys], dtype=np.int64);
+    table = benjmark.make_table(np.searchsorted(sizes, size),
+                                np.searchsorted(ids, cand_id).astype(np.int32),
+                                time_seconds, cand_keys, sizes);
+    return pyr.pmap({
+        'candidates': {k: {'name': c['name']} for k, c in candidates.items()},
+        'problems': pyr.pvector([{'index': i, 'size': int(s)} for i, s in enumerate(sizes)]),
+        'table': table});
+
+# The median time of every candidate in every selected run, for one problem
+# size, by default the largest size that all candidates ran. A run is
+# assumed to hold one problem of every size.
+def trend(conn, benchmark, keys, size=None, last=None, host=None):
+    candidates = load_candidates(conn, benchmark, keys);
+    runs, params = run_selection(benchmark, last, host);
+    cand_filter = candidate_filter(candidates);
+    if size == None:
+        size = conn.execute('SELECT MIN(s) FROM (SELECT MAX(size) AS s FROM results '
+                            'WHERE run_id IN (' + runs + ')' + cand_filter + ' GROUP BY cand_id)',
+                            params).fetchone()[0];
+    timestamp, cand_id, median = fetch_columns(
+        conn,
+        'SELECT runs.timestamp, cand_id, median FROM results JOIN runs ON runs.id = run_id '
+        'WHERE run_id IN (' + runs + ')' + cand_filter + ' AND size = ? ORDER BY runs.timestamp',
+        params + [size], [np.float64, np.int64, np.float64]);
+    rows = [];
+    for k, c in candidates.items():
+        mask = cand_id == c['id'];
+        rows += [{'cand-key': k, 'timestamp': float(t), 'median': float(m)}
+                 for t, m in zip(timestamp[mask], median[mask])];
+    return {'size': size, 'rows': rows,
+            'names': {k: c['name'] for k, c in candidates.items()}};
+
+def render_trendplot(trend_data, keys, settings):
+    fig, ax = benjmark.make_plot();
+    for k in keys:
+        rs = [r for r in trend_data['rows'] if r['cand-key'] == k];
+        dates = [datetime.datetime.fromtimestamp(r['timestamp']) for r in rs];
+        ax.plot(dates, [r['median'] for r in rs], marker='o',
+                label=trend_data['names'].get(k, k));
+    if settings['logy']:
+        ax.set_yscale('log');
+    ax.set_ylabel(settings['ylabel'], fontsize=settings['fontsize']);
+    ax.set_title(settings['sizeformat'].format(int(trend_data['size'])));
+    ax.legend();
+    fig.autofmt_xdate();
+    benjmark.finish_plot(ax, settings);
+    return figureoutput.save(fig, settings['outputprefix'] + 'trendplot.pdf', settings);
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjdb',
+        description='Keep a history of benchmark results in a SQLite database.');
+    commands = parser.add_subparsers(dest='command', required=True);
+    ingest_parser = commands.add_parser('ingest', help='Add the results of roots as new runs');
+    ingest_parser.add_argument('database');
+    ingest_parser.add_argument('roots', nargs='+');
+    ingest_parser.add_argument('--benchmark', help='Benchmark name, by default the root directory name');
+    ingest_parser.add_argument('--host');
+    for name, text in [('plot', 'Line and bar plots of the pooled runs'),
+                       ('trend', 'Median times over the runs, for one size')]:
+        p = commands.add_parser(name, help=text);
+        p.add_argument('database');
+        p.add_argument('benchmark');
+        p.add_argument('--keys', help='Comma-separated candidate keys');
+        p.add_argument('--last', type=int, help='Only the most recent runs');
+        p.add_argument('--host');
+        p.add_argument('--outputprefix', default=benjmark.default_settings['outputprefix']);
+        if name == 'trend':
+            p.add_argument('--size', type=int);
+    args = parser.parse_args(argv);
+
+    conn = connect(args.database);
+    if args.command == 'ingest':
+        for root in args.roots:
+            run_id = ingest(conn, root, args.benchmark, args.host);
+            print('{:s}: {:s}'.format(root, 'already ingested' if run_id == None
+                                      else 'run {:d}'.format(run_id)));
+        return 0;
+
+    keys = None if args.keys == None else args.keys.split(',');
+    settings = benjmark.default_settings.set('outputprefix', args.outputprefix);
+    if args.command == 'plot':
+        loaded = query(conn, args.benchmark, keys, args.last, args.host);
+        keys = keys or sorted(loaded['candidates']);
+        benjmark.render_barplots(keys, loaded, settings);
+        benjmark.render_lineplot(keys, loaded, settings);
+    else:
+        data = trend(conn, args.benchmark, keys, args.size, args.last, args.host);
+        render_trendplot(data, keys or sorted(data['names']), settings);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
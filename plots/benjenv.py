@@ -0,0 +1,155 @@
+import os
+import glob
+import time
+import socket
+import platform
+
+# Snapshots of the machine a benchmark runs on, read from /proc and /sys,
+# and a short calibration kernel. benjrun records a snapshot before and
+# after every run in the environment.json of the root, and benjmark uses
+# them to flag runs taken under noisy conditions and to normalize times.
+# Values that cannot be read on this machine are None.
+
+environment_filename = 'environment.json';
+
+def read_text(filename):
+    try:
+        with open(filename) as f:
+            return f.read().strip();
+    except OSError:
+        return None;
+
+def cpu_model():
+    text = read_text('/proc/cpuinfo');
+    if text != None:
+        for line in text.splitlines():
+            if line.startswith('model name'):
+                return line.split(':', 1)[1].strip();
+    return platform.processor() or None;
+
+def cpu_values(name, parse):
+    dst = {};
+    for filename in sorted(glob.glob('/sys/devices/system/cpu/cpu[0-9]*/cpufreq/' + name)):
+        text = read_text(filename);
+        if text != None:
+            dst[filename.split('/')[5]] = parse(text);
+    return dst;
+
+def load_average():
+    text = read_text('/proc/loadavg');
+    if text == None:
+        return None;
+    return [float(x) for x in text.split()[0:3]];
+
+# The 'some avg10' of /proc/pressure/memory: The percentage of the last ten
+# seconds in which some task waited for memory.
+def memory_pressure():
+    text = read_text('/proc/pressure/memory');
+    if text == None:
+        return None;
+    for field in text.splitlines()[0].split():
+        if field.startswith('avg10='):
+            return float(field[6:]);
+    return None;
+
+def memory_available_kib():
+    text = read_text('/proc/meminfo');
+    if text != None:
+        for line in text.splitlines():
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]);
+    return None;
+
+def snapshot():
+    return {'time': time.time(),
+            'host': socket.gethostname(),
+            'kernel': read_text('/proc/sys/kernel/osrelease') or platform.release(),
+            'cpu-model': cpu_model(),
+            'cpu-count': os.cpu_count(),
+            'isolcpus': read_text('/sys/devices/system/cpu/isolated'),
+            'governors': cpu_values('scaling_governor', str),
+            'frequencies-khz': cpu_values('scaling_cur_freq', int),
+            'load-average': load_average(),
+            'memory-pressure': memory_pressure(),
+            'memory-available-kib': memory_available_kib()};
+
+def calibration_kernel(n):
+    s = 0;
+    for i in range(0, n):
+        s += i*i;
+    return s;
+
+# The best time, in seconds, of a fixed amount of interpreted work. Lower
+# is faster; the ratio of two scores estimates the speed ratio of the
+# machine at the two times. Many short repetitions give a steadier best
+# time than a few long ones on machines whose speed varies, such as VMs.
+def calibrate(repetitions=40, n=50000):
+    best = None;
+    for i in range(0, repetitions):
+        start = time.perf_counter();
+        calibration_kernel(n);
+        t = time.perf_counter() - start;
+        best = t if best == None else min(best, t);
+    return best;
+
+def capture():
+    return dict(snapshot(), calibration=calibrate());
+
+###################################### Noise
+
+default_thresholds = {
+    # Load average per core before the run, whose own processes would
+    # count towards the load after it
+    'load': 0.5,
+    # Percentage in /proc/pressure/memory
+    'memory-pressure': 1.0,
+    # Relative spread of the current frequencies of the cores used
+    'frequency-spread': 0.2,
+    # Relative change of the calibration from before to after the run
+    'calibration-drift': 0.25
+};
+
+def spread(values):
+    values = [v for v in values if v != None and 0 < v];
+    if len(values) < 2:
+        return 0.0;
+    return (max(values) - min(values))/max(values);
+
+# The values of the cores in 'cpus', or of all cores if it is None
+def core_values(values, cpus):
+    values = values or {};
+    if cpus == None:
+        return list(values.values());
+    return [values[k] for k in ['cpu{:d}'.format(c) for c in cpus] if k in values];
+
+def snapshot_reasons(s, thresholds, cpus):
+    reasons = [];
+    pressure = s.get('memory-pressure');
+    if pressure != None and thresholds['memory-pressure'] < pressure:
+        reasons.append('memory-pressure');
+    if thresholds['frequency-spread'] < spread(core_values(s.get('frequencies-khz'), cpus)):
+        reasons.append('frequency');
+    if any(g != 'performance' for g in core_values(s.get('governors'), cpus)):
+        reasons.append('governor');
+    return reasons;
+
+# Why a run of environment.json is considered noisy, if it is. Only the
+# cores in the 'cpus' of the run, if it has them, are considered.
+def noise_reasons(record, thresholds=default_thresholds):
+    before = record['before'];
+    after = record['after'];
+    cpus = record.get('cpus');
+    reasons = snapshot_reasons(before, thresholds, cpus) + snapshot_reasons(after, thresholds, cpus);
+    load = before.get('load-average');
+    if load != None and thresholds['load']*(before.get('cpu-count') or 1) < load[0]:
+        reasons.append('load');
+    if thresholds['calibration-drift'] < spread([before.get('calibration'), after.get('calibration')]):
+        reasons.append('calibration-drift');
+    if before.get('host') != after.get('host'):
+        reasons.append('host');
+    return sorted(set(reasons));
+
+def calibration_score(record):
+    scores = [record[k].get('calibration') for k in ['before', 'after']];
+    scores = [s for s in scores if s != None];
+    return sum(scores)/len(scores) if 0 < len(scores) else None;
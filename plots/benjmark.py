@@ -1,8 +1,17 @@
+import time
+started = time.perf_counter();
+
 import pyrsistent as pyr
 import json
-import matplotlib
-import matplotlib.pyplot as plt
+import os
+import re
+import sys
+import hashlib
 import math
+import numpy as np
+import stages
+import benjenv
+import figureoutput
 
 default_settings = pyr.pmap({
     "logx": True,
@@ -12,9 +21,28 @@ default_settings = pyr.pmap({
     "fontsize": 12,
     "ylabel": 'Duration (s)',
     "xlabel": 'Data size',
-    "sizeformat": "Data size {:d}"
-})
+    "sizeformat": "Data size {:d}",
+    "bootstrap": 1000,
+    "confidence": 0.95,
+    "seed": 0,
+
+    # Fit a scaling law ('power': t = a*n^b, or 'linear': t = a + b*n)
+    # to every line of the line plot, optionally with robust weights,
+    # and draw it up to 'extrapolate' times the largest size.
+    "fit": None,
+    "robust": False,
+    "extrapolate": 1.0,
+
+    # Number of processes rendering the bar plots, 0 meaning one per core
+    "jobs": 1,
+
+    # Scale the times of every run recorded in environment.json by its
+    # calibration score relative to the median score of the root, so that
+    # runs on a slower or throttled machine become comparable.
+    "normalize": False
+}).update(figureoutput.default_settings)
 
+@stages.stage('load')
 def load_json_data(filename):
     with open(filename) as f:
         return json.load(f);
@@ -22,43 +50,328 @@ def load_json_data(filename):
 def load_candidates(root):
     return load_json_data(root + "/candidates.json");
 
-def load_results(root):
-    return load_json_data(root + "/results.json");
+def problem_filename(index):
+    return 'problem{:04d}.json'.format(index);
+
+catalog_filename = "problemcatalog.json";
+scan_block_size = 1 << 16;
+
+json_token = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]');
+json_number = re.compile(rb'\s*:\s*(-?[0-9][0-9.eE+-]*)');
+payload_start = re.compile(rb'[\[,]\s*(?=[-0-9\[])');
+
+def depth_change(buf):
+    d = 0;
+    for m in json_token.finditer(buf):
+        c = m.group()[0:1];
+        if c == b'{' or c == b'[':
+            d += 1;
+        elif c == b'}' or c == b']':
+            d -= 1;
+    return d;
+
+# Look for '"key": <number>' at the top level of the JSON object,
+# given that 'buf' starts at nesting depth 'depth'.
+def find_top_level_number(buf, key, depth):
+    quoted = b'"' + key + b'"';
+    for m in json_token.finditer(buf):
+        t = m.group();
+        c = t[0:1];
+        if c == b'{' or c == b'[':
+            depth += 1;
+        elif c == b'}' or c == b']':
+            depth -= 1;
+        elif depth == 1 and t == quoted:
+            n = json_number.match(buf, m.end());
+            if n != None:
+                return json.loads(n.group(1));
+    return None;
 
+# Extract the 'size' of a problem without decoding its 'data': First
+# look at the beginning of the file, then at its end, and only parse the
+# whole file if neither contains the top-level key.
+def scan_problem_size(filename):
+    with open(filename, 'rb') as f:
+        prefix = f.read(scan_block_size);
+        size = find_top_level_number(prefix, b'size', 0);
+        if size != None:
+            return size;
+        f.seek(0, os.SEEK_END);
+        total = f.tell();
+        if scan_block_size < total:
+            f.seek(total - scan_block_size);
+            suffix = f.read();
+            m = payload_start.search(suffix);
+            if m != None:
+                suffix = suffix[m.end():];
+                size = find_top_level_number(suffix, b'size', -depth_change(suffix));
+                if size != None:
+                    return size;
+    return load_json_data(filename)['size'];
+
+def file_hash(filename):
+    h = hashlib.sha1();
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block);
+    return h.hexdigest();
+
+def load_problem_catalog(root):
+    try:
+        return load_json_data(root + "/" + catalog_filename)["problems"];
+    except (OSError, ValueError, KeyError):
+        return {};
+
+def save_problem_catalog(root, entries):
+    filename = root + "/" + catalog_filename;
+    try:
+        with open(filename + ".tmp", 'w') as f:
+            json.dump({"problems": entries}, f, indent=1, sort_keys=True);
+        os.replace(filename + ".tmp", filename);
+    except OSError:
+        pass;
+
+# Bring the catalog entry of a problem file up to date. The entry is
+# reused as long as file size and mtime are unchanged, or, if they changed,
+# as long as the content hash is unchanged.
+def refresh_catalog_entry(filename, entry):
+    st = os.stat(filename);
+    if entry != None and entry['bytes'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        return entry;
+    digest = file_hash(filename);
+    if entry != None and entry['sha1'] == digest:
+        size = entry['size'];
+    else:
+        size = scan_problem_size(filename);
+    return {'size': size,
+            'bytes': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha1': digest};
+
+def refresh_problem_catalog(root):
+    info = load_json_data(root + "/probleminfo.json");
+    old = load_problem_catalog(root);
+    entries = {};
+    for i in range(0, info["count"]):
+        name = problem_filename(i);
+        entries[name] = refresh_catalog_entry(root + '/' + name, old.get(name));
+    if entries != old:
+        save_problem_catalog(root, entries);
+    return entries
+
+@stages.stage('problems')
 def load_problems(root):
     info = load_json_data(root + "/probleminfo.json");
+    catalog = refresh_problem_catalog(root);
     results = pyr.pvector();
     for i in range(0, info["count"]):
-        prob = load_json_data(root + '/problem{:04d}.json'.format(i));
-        results = results.append({'index': i, 'size': prob["size"]})
+        results = results.append({'index': i, 'size': catalog[problem_filename(i)]['size']})
+    stages.count('problems', len(results));
     return results
 
-def make_per_problem_map(results, problems):
-    top = {};
+# A problem as {'size', 'data'}, read from its binary companion if there
+# is a current one (see benjbin.py), in which case the large arrays are
+# NumPy arrays mapped from the file
+def load_problem(root, index):
+    import benjbin
+    filename = root + "/" + problem_filename(index);
+    if benjbin.is_current(filename):
+        return benjbin.load_problem(benjbin.binary_filename(filename));
+    return load_json_data(filename);
+
+# The files of a benchmark root that the plots depend on, besides the
+# problem sizes
+def root_files(root):
+    return [root + "/" + name for name in ["results.json", "candidates.json", "probleminfo.json",
+                                           benjenv.environment_filename]];
+
+# The keys that are candidates of the root, for plot scripts listing
+# candidates that may not have been run yet
+def available_keys(keys, root):
+    candidates = load_candidates(root);
+    return [k for k in keys if k in candidates];
+
+@stages.stage('results')
+def load_results(root, problems=None):
+    if problems == None:
+        problems = load_problems(root);
+    return make_results_table(load_json_data(root + "/results.json"), problems);
+
+# Split the rows, taken in the order of 'order', into one group per code in range(count)
+def group_rows(codes, order, count):
+    sorted_codes = codes[order];
+    perm = np.argsort(sorted_codes, kind='stable');
+    rows = order[perm];
+    bounds = np.searchsorted(sorted_codes[perm], np.arange(count + 1));
+    return [rows[bounds[i]:bounds[i+1]] for i in range(0, count)];
+
+# The results as typed columns, with the candidate keys dictionary-encoded
+# in 'cand-code'. The grouping by problem is computed once, here, as row
+# indices.
+# A result may hold the timings of the repetitions within its process in
+# 'time-samples'. They are not independent of each other, as they share
+# the state of the process, so a result is one row with their median,
+# and only the processes are resampled by the bootstrap.
+@stages.stage('group')
+def make_results_table(results, problems):
+    problem_sizes = np.array([p['size'] for p in problems], dtype=np.int64);
+    cand_keys = [];
+    cand_codes = {};
+    problem_index = [];
+    cand_code = [];
+    time_seconds = [];
+    run_id = [];
     for r in results:
-        problem_index = r['problem-index'];
-        cand_key = r['cand-key'];
-        time_seconds = r['time-seconds'];
-        problem = problems[problem_index];
-        problem_size = problem['size'];
-        sub_map = {};
-        probkey = problem_index;
-        if probkey in top:
-            sub_map = top[probkey];
-        sub_map[cand_key] = time_seconds;
-        top[probkey] = sub_map;
+        k = r['cand-key'];
+        code = cand_codes.get(k);
+        if code == None:
+            code = len(cand_keys);
+            cand_codes[k] = code;
+            cand_keys.append(k);
+        samples = r.get('time-samples');
+        problem_index.append(r['problem-index']);
+        cand_code.append(code);
+        time_seconds.append(r['time-seconds'] if not(samples) else float(np.median(samples)));
+        run_id.append(r.get('run-id', -1));
+    return make_table(np.array(problem_index, dtype=np.int64),
+                      np.array(cand_code, dtype=np.int32),
+                      np.array(time_seconds, dtype=np.float64),
+                      cand_keys, problem_sizes,
+                      np.array(run_id, dtype=np.int64));
+
+# The results table from its columns, where 'problem_sizes' maps a problem
+# index to its size. 'run_id' refers to the runs of environment.json, -1
+# meaning that the run of a row is unknown.
+def make_table(problem_index, cand_code, time_seconds, cand_keys, problem_sizes, run_id=None):
+    n = len(time_seconds);
+    if run_id is None:
+        run_id = np.full(n, -1, dtype=np.int64);
+    stages.count('rows', n);
+    size = problem_sizes[problem_index];
+
+    by_problem = group_rows(problem_index, np.arange(n), len(problem_sizes));
+
+    return pyr.pmap({
+        'problem-index': problem_index,
+        'size': size,
+        'cand-code': cand_code,
+        'time-seconds': time_seconds,
+        'run-id': run_id,
+        'cand-keys': tuple(cand_keys),
+        'by-problem': pyr.pvector(by_problem)
+    });
+
+# Medians of 'count' bootstrap resamples of every row of 'padded', where
+# row i holds counts[i] samples followed by NaN padding.
+def bootstrap_medians(padded, counts, count, rng):
+    group_count, width = padded.shape;
+    dst = np.empty((group_count, count));
+    step = max(1, (1 << 22) // max(1, count*width));
+    valid = np.arange(width)[None, None, :];
+    for a in range(0, group_count, step):
+        b = min(group_count, a + step);
+        n = counts[a:b, None, None];
+        inds = (rng.random((b - a, count, width))*n).astype(np.int64);
+        values = padded[np.arange(a, b)[:, None, None], inds];
+        dst[a:b] = np.nanmedian(np.where(valid < n, values, np.nan), axis=2);
+    return dst;
+
+def interval_percentiles(settings):
+    alpha = 1.0 - settings['confidence'];
+    return [50.0*alpha, 100.0 - 50.0*alpha];
+
+# Median, MAD, min and a bootstrap confidence interval of the median
+# for every (problem, candidate) pair of the table. The rows of every
+# candidate, ordered by problem size, are in 'by-candidate'.
+@stages.stage('statistics')
+def sample_statistics(table, settings):
+    cand_count = max(1, len(table['cand-keys']));
+    pair = table['problem-index']*cand_count + table['cand-code'];
+    keys, first, inverse, counts = np.unique(
+        pair, return_index=True, return_inverse=True, return_counts=True);
+    group_count = len(keys);
+    width = counts.max() if 0 < group_count else 0;
+
+    order = np.argsort(inverse, kind='stable');
+    offsets = np.cumsum(counts) - counts;
+    slots = np.arange(len(pair)) - np.repeat(offsets, counts);
+    padded = np.full((group_count, width), np.nan);
+    padded[inverse[order], slots] = table['time-seconds'][order];
+
+    median = np.nanmedian(padded, axis=1);
+    if 0 < settings['bootstrap']:
+        boot = bootstrap_medians(padded, counts, settings['bootstrap'],
+                                 np.random.default_rng(settings['seed']));
+        low, high = np.percentile(boot, interval_percentiles(settings), axis=1);
+    else:
+        boot = median[:, None];
+        low = median;
+        high = median;
+    size = table['size'][first];
+    cand_code = table['cand-code'][first];
+    by_candidate = group_rows(cand_code, np.argsort(size, kind='stable'), len(table['cand-keys']));
+    return pyr.pmap({
+        'problem-index': table['problem-index'][first],
+        'size': size,
+        'cand-code': cand_code,
+        'cand-keys': table['cand-keys'],
+        'by-candidate': pyr.pmap(zip(table['cand-keys'], by_candidate)),
+        'count': counts,
+        'median': median,
+        'mad': np.nanmedian(np.abs(padded - median[:, None]), axis=1),
+        'min': np.nanmin(padded, axis=1),
+        'ci-low': low,
+        'ci-high': high,
+        'bootstrap': boot
+    });
+
+# Ratios of times, where those with a zero time, such as the C++ times
+# below the resolution of the clock, are NaN
+def time_ratios(num, den):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = num/den;
+    return np.where(np.isfinite(ratios), ratios, np.nan);
+
+# Percentiles along the last axis, ignoring NaN, and NaN if there is no ratio
+def ratio_percentiles(ratios, settings):
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning);
+        return np.nanpercentile(ratios, interval_percentiles(settings), axis=-1);
+
+# Confidence interval of the ratio between the medians of two groups
+def ratio_interval(stats, group, reference, settings):
+    boot = stats['bootstrap'];
+    return ratio_percentiles(time_ratios(boot[group], boot[reference]), settings);
+
+# Map from problem index to a map from candidate key to the row in 'stats'
+@stages.stage('group')
+def make_per_problem_map(stats):
+    cand_keys = stats['cand-keys'];
+    top = {};
+    for g in range(0, len(stats['count'])):
+        sub_map = top.setdefault(int(stats['problem-index'][g]), {});
+        sub_map[cand_keys[stats['cand-code'][g]]] = g;
     return top
 
+# Matplotlib is only imported once something is plotted
+def pyplot():
+    import matplotlib.pyplot as plt
+    stages.install_savefig();
+    return plt;
+
 def make_plot():
-    fig = plt.figure();
+    fig = pyplot().figure();
     ax = fig.add_subplot(1, 1, 1);
     return (fig, ax);
 
 def finish_plot(ax, settings):
     if settings['interactive']:
-        plt.show();
+        pyplot().show();
 
 def basic_format(x):
+    if not(math.isfinite(x)):
+        return '?';
     if x <= 0:
         return '0'
 
@@ -67,101 +380,628 @@ def basic_format(x):
         return ("{:." + str(1-level) + "f}").format(x);
     else:
         return "{:d}".format(round(x));
-        
 
-def render_barplots(keys, root, settings):
-    candidates = load_candidates(root);
-    results = load_results(root);
+
+def interval_format(low, high):
+    return "[" + basic_format(low) + ", " + basic_format(high) + "]";
+
+# Everything needed to draw the bar plot of one problem, so that
+# it can be sent to a worker process. None if none of the keys has
+# results for the problem.
+def make_barplot_spec(prob, m, stats, candidates, keys, settings, noisy=False):
+    median = stats['median'];
+    leftmost = None;
+    X = [];
+    G = [];
+    labels = [];
+
+    for k in keys:
+        if k in m:
+            X.append(len(X) + 1);
+            g = m[k];
+            if leftmost == None:
+                leftmost = g;
+            G.append(g);
+            labels.append(candidates[k]['name']);
+    if leftmost == None:
+        return None;
+
+    Y = median[G];
+    sampled = 1 < stats['count'][G];
+    yerr = None;
+    if sampled.any():
+        yerr = np.where(sampled, [Y - stats['ci-low'][G], stats['ci-high'][G] - Y], 0.0);
+
+    texts = [];
+    if 0 < median[leftmost]:
+        for i in range(0, len(X)):
+            y = Y[i]
+            label = basic_format(y/median[leftmost]) + "×";
+            if sampled[i] and 1 < stats['count'][leftmost]:
+                label += " " + interval_format(*ratio_interval(stats, G[i], leftmost, settings));
+            texts.append(label + "\n" + basic_format(y) + " s");
+
+    return {'X': X,
+            'Y': Y,
+            'yerr': yerr,
+            'labels': labels,
+            'texts': texts,
+            'title': settings['sizeformat'].format(prob['size']) + (' (noisy)' if noisy else ''),
+            'filename': settings['outputprefix'] + 'bars{:04d}.pdf'.format(prob['index'])};
+
+@stages.stage('draw')
+def draw_barplot(ax, spec, settings):
+    X = spec['X'];
+    Y = spec['Y'];
+    bars = ax.bar(X, Y, yerr=spec['yerr'], capsize=4, tick_label=spec['labels'], log=settings['logy']);
+    figureoutput.layer(list(bars), 'bars', settings);
+
+    fs = settings['fontsize'];
+    for x, y, text in zip(X, Y, spec['texts']):
+        yp = 3*y;
+        ax.plot([x], [yp], alpha=0.0);
+        ax.text(x, yp, text,
+                fontsize=fs,
+                horizontalalignment='center',
+                verticalalignment='top'
+        );
+
+    ax.tick_params(labelsize=fs)
+    ax.set_title(spec['title']);
+    ax.set_ylabel(settings['ylabel'], fontsize=fs);
+
+# Worker of the parallel mode: The figure is not registered with
+# pyplot, and is released as soon as it has been saved.
+def render_barplot_job(spec, settings):
+    from matplotlib.figure import Figure
+    stages.install_savefig();
+    fig = Figure();
+    ax = fig.add_subplot(1, 1, 1);
+    draw_barplot(ax, spec, settings);
+    filenames = figureoutput.save(fig, spec['filename'], settings);
+    fig.clear();
+    del fig;
+    return filenames;
+
+def render_barplot_jobs(specs, settings):
+    import concurrent.futures
+    jobs = settings['jobs'];
+    if jobs <= 0:
+        jobs = os.cpu_count();
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(stages.collect, render_barplot_job, spec, settings) for spec in specs];
+        filenames = [];
+        for f in futures:
+            written, collected = f.result();
+            stages.merge(collected);
+            filenames += written;
+        return filenames;
+
+# The candidates, problems and results table of a root, loaded once. The
+# rendering functions accept such a map in place of a root directory, for
+# results that come from elsewhere (see benjdb.py).
+def load_root(root):
     problems = load_problems(root);
+    return pyr.pmap({'candidates': load_candidates(root),
+                     'problems': problems,
+                     'table': load_results(root, problems),
+                     'environment': load_environment(root)});
+
+# A loaded root, with the times normalized if the settings say so
+def as_loaded_root(root, settings=default_settings):
+    loaded = root;
+    if isinstance(root, str):
+        loaded = load_root(root);
+    if settings['normalize']:
+        loaded = normalize_times(loaded);
+    return loaded;
+
+def render_barplots(keys, root, settings):
+    loaded = as_loaded_root(root, settings);
+    candidates = loaded['candidates'];
+    problems = loaded['problems'];
+    table = loaded['table'];
+    stats = sample_statistics(table, settings);
+    noisy_problems = set(table['problem-index'][
+        noisy_rows(table, noisy_runs(loaded.get('environment', [])))].tolist());
 
     for key in keys:
         assert(key in candidates);
 
-    ppm = make_per_problem_map(results, problems);
-    print(ppm)
-    
-    for prob in problems:
-        leftmost = None;
+    ppm = make_per_problem_map(stats);
+    # Problems without results for the keys, such as those just added by
+    # benjplan.py, have no bar plot
+    specs = [make_barplot_spec(prob, ppm[prob['index']], stats, candidates, keys, settings,
+                               prob['index'] in noisy_problems)
+             for prob in problems
+             if any(k in ppm.get(prob['index'], {}) for k in keys)];
+
+    if settings['jobs'] != 1 and not(settings['interactive']):
+        return render_barplot_jobs(specs, settings);
+
+    filenames = [];
+    for spec in specs:
         fig, ax = make_plot();
-        
-        problem_index = prob['index']
-        problem_size = prob['size']
-        m = ppm[problem_index];
-
-        X = [];
-        Y = [];
-        labels = [];
-
-        for k in keys:
-            if k in m:
-                X.append(len(X) + 1);
-                dur = m[k];
-                if leftmost == None:
-                    leftmost = dur;
-                Y.append(dur);
-                labels.append(candidates[k]['name']);
-
-        plt.bar(X, Y, tick_label=labels, log=settings['logy']);
-
-
-        fs = settings['fontsize'];
-        n = len(X);
-        if 0 < leftmost:
-            for i in range(0, n):
-                x = X[i]
-                y = Y[i]
-                yp = 3*y;
-                ax.plot([x], [yp], alpha=0.0);
-                ax.text(x, yp, basic_format(y/leftmost) + "×\n" 
-                        + basic_format(y) + " s", 
-                        fontsize=fs,
-                        horizontalalignment='center',
-                        verticalalignment='top'
-                );
-
-                #ax.xaxis.set_tick_params(fontsize=settings['fontsize'])
-        ax.tick_params(labelsize=fs)
-        plt.title(settings['sizeformat'].format(problem_size));
-        plt.ylabel(settings['ylabel'], fontsize=fs);
-        fig.savefig(settings['outputprefix'] + 'bars{:04d}.pdf'.format(problem_index));
+        draw_barplot(ax, spec, settings);
+        filenames += figureoutput.save(fig, spec['filename'], settings);
         finish_plot(ax, settings);
-    
-def get_sizes_and_times(results, problems, cand_key):
-    pairs = [];
-    for r in results:
-        pi = r['problem-index'];
-        problem = problems[pi];
-        if r['cand-key'] == cand_key:
-            pairs.append([problem['size'], r['time-seconds']]);
-    pairs.sort(key=lambda pair: pair[0]);
-    X = [];
-    Y = [];
-    for p in pairs:
-        X.append(p[0])
-        Y.append(p[1]);
-    return (X, Y);
+        pyplot().close(fig);
+    return filenames;
 
+# The rows in 'stats' of a candidate, ordered by problem size
+def candidate_rows(stats, cand_key):
+    return stats['by-candidate'].get(cand_key, np.empty(0, dtype=np.int64));
 
-def render_lineplot(keys, root, settings):
+# The statistics of a candidate, ordered by problem size
+def get_sizes_and_stats(stats, cand_key):
+    rows = candidate_rows(stats, cand_key);
+    return pyr.pmap({k: stats[k][rows] for k in
+                     ['size', 'count', 'median', 'mad', 'min', 'ci-low', 'ci-high']});
+
+# Draw one line per (label, series), where a series has the 'size',
+# 'median', 'ci-low', 'ci-high' and 'count' of get_sizes_and_stats.
+@stages.stage('draw')
+def draw_lineplot(ax, series, settings):
     fs = settings['fontsize']
-    results = load_results(root);
-    problems = load_problems(root);
-    cands = load_candidates(root);
-    fig, ax = make_plot();
     if settings['logx']:
         ax.set_xscale('log');
     if settings['logy']:
         ax.set_yscale('log');
-    for k in reversed(keys):
-        assert(k in cands)
-        X, Y = get_sizes_and_times(results, problems, k);
-        label = cands[k]['name']
-        ax.plot(X, Y, label=label);
+    lines = [];
+    for label, s in series:
+        [line] = ax.plot(s['size'], s['median'], label=label);
+        figureoutput.layer(line, 'lines', settings);
+        if (1 < s['count']).any():
+            band = ax.fill_between(s['size'], s['ci-low'], s['ci-high'],
+                                   color=line.get_color(), alpha=0.25, linewidth=0);
+            figureoutput.layer(band, 'lines', settings);
+        lines.append(line);
     ax.legend(prop={'size': fs})
     ax.tick_params(labelsize=fs);
-    plt.ylabel(settings['ylabel']);
-    plt.xlabel(settings['xlabel']);
+    ax.set_ylabel(settings['ylabel']);
+    ax.set_xlabel(settings['xlabel']);
+    return lines;
+
+def save_lineplot(series, settings, name, reference=None, overlay=None, note=None):
+    fig, ax = make_plot();
+    lines = draw_lineplot(ax, series, settings);
+    if overlay != None:
+        overlay(ax, lines);
+    if reference != None:
+        ax.axhline(reference, color='gray', linestyle='--', linewidth=1);
+    if note != None:
+        ax.text(0.01, 0.99, note, transform=ax.transAxes, color='red',
+                fontsize=0.75*settings['fontsize'],
+                horizontalalignment='left', verticalalignment='top');
     finish_plot(ax, settings);
-    fig.savefig(settings['outputprefix'] + "lineplot.pdf");
-        
-        
+    return figureoutput.save(fig, settings['outputprefix'] + name, settings);
+
+def render_lineplot(keys, root, settings):
+    loaded = as_loaded_root(root, settings);
+    stats = sample_statistics(loaded['table'], settings);
+    cands = loaded['candidates'];
+    for k in keys:
+        assert(k in cands)
+    keys = list(reversed(keys));
+    series = [(cands[k]['name'], get_sizes_and_stats(stats, k)) for k in keys];
+    # Only the noisy runs that the plotted candidates have results of
+    table = loaded['table'];
+    noisy = noisy_runs(loaded.get('environment', []));
+    plotted = np.isin(table['cand-code'], [i for i, k in enumerate(table['cand-keys']) if k in keys]);
+    plotted_runs = set(table['run-id'][plotted & noisy_rows(table, noisy)].tolist());
+    noisy = {k: v for k, v in noisy.items() if k in plotted_runs};
+    note = noise_note(noisy) if 0 < len(noisy) else None;
+    if settings['fit'] == None:
+        return save_lineplot(series, settings, "lineplot.pdf", note=note);
+
+    fits = fit_scaling_laws([(s['size'], s['median']) for _, s in series],
+                            settings['fit'], settings['robust']);
+    crossings = crossovers(fits);
+    largest = max([s['size'].max() for _, s in series if 0 < len(s['size'])], default=1);
+    smallest = min([s['size'].min() for _, s in series if 0 < len(s['size'])], default=1);
+    extent = [smallest, largest*settings['extrapolate']];
+    overlay = lambda ax, lines: draw_fits(ax, lines, fits, crossings, extent, settings);
+    filenames = save_lineplot(series, settings, "lineplot.pdf", overlay=overlay, note=note);
+
+    filename = settings['outputprefix'] + "fit.json";
+    with open(filename, 'w') as f:
+        json.dump(fit_report(keys, fits, crossings, extent), f, indent=1);
+    return filenames + [filename];
+
+
+
+###################################### Environment
+
+# The runs recorded by benjrun.py, with the machine state before and
+# after each of them (see benjenv.py)
+def load_environment(root):
+    filename = root + "/" + benjenv.environment_filename;
+    if os.path.exists(filename):
+        return load_json_data(filename);
+    return [];
+
+# The reasons why each noisy run is considered noisy, by run id
+def noisy_runs(environment):
+    dst = {};
+    for record in environment:
+        reasons = benjenv.noise_reasons(record);
+        if 0 < len(reasons):
+            dst[record['run-id']] = reasons;
+    return dst;
+
+def noisy_rows(table, noisy):
+    return np.isin(table['run-id'], list(noisy.keys()));
+
+def noise_note(noisy):
+    reasons = sorted(set(r for rs in noisy.values() for r in rs));
+    return 'Noisy runs: {:d} ({:s})'.format(len(noisy), ', '.join(reasons));
+
+# The factor that the times of every row are multiplied by: The median
+# calibration score of the runs divided by the score of the run of the row.
+def calibration_factors(table, environment):
+    scores = {r['run-id']: benjenv.calibration_score(r) for r in environment};
+    scores = {k: v for k, v in scores.items() if v != None and 0 < v};
+    factors = np.ones(len(table['run-id']));
+    if 0 < len(scores):
+        reference = np.median(list(scores.values()));
+        for run_id, score in scores.items():
+            factors[table['run-id'] == run_id] = reference/score;
+    return factors;
+
+def normalize_times(loaded):
+    table = loaded['table'];
+    factors = calibration_factors(table, loaded.get('environment', []));
+    return loaded.set('table', table.set('time-seconds', table['time-seconds']*factors));
+
+###################################### Scaling laws
+
+# Weighted least-squares fit of y = intercept + slope*x to every row of
+# X and Y at once. Rows are padded, and 'W' is zero for the padding.
+def weighted_line_fits(X, Y, W):
+    Sw = W.sum(axis=1);
+    Sx = (W*X).sum(axis=1);
+    Sy = (W*Y).sum(axis=1);
+    Sxx = (W*X*X).sum(axis=1);
+    Sxy = (W*X*Y).sum(axis=1);
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (Sw*Sxy - Sx*Sy)/(Sw*Sxx - Sx*Sx);
+        intercept = (Sy - slope*Sx)/Sw;
+    return (intercept, slope);
+
+# Fit a scaling law to every (sizes, times) series. With 'robust', the
+# fit is iteratively reweighted with Huber weights, so that single
+# outliers, such as a run disturbed by JIT compilation, count less.
+@stages.stage('fit')
+def fit_scaling_laws(series, model, robust, iterations=20):
+    count = len(series);
+    width = max([len(x) for x, _ in series], default=0);
+    X = np.zeros((count, width));
+    Y = np.zeros((count, width));
+    M = np.zeros((count, width), dtype=bool);
+    for i, (x, y) in enumerate(series):
+        n = len(x);
+        X[i, 0:n] = x;
+        Y[i, 0:n] = y;
+        M[i, 0:n] = True;
+    if model == 'power':
+        M &= (0 < X) & (0 < Y);
+        X = np.log(np.where(M, X, 1.0));
+        Y = np.log(np.where(M, Y, 1.0));
+    elif model != 'linear':
+        raise ValueError('Unknown model: ' + str(model));
+
+    W = M.astype(np.float64);
+    intercept, slope = weighted_line_fits(X, Y, W);
+    for i in range(0, iterations if robust else 0):
+        R = np.abs(Y - intercept[:, None] - slope[:, None]*X);
+        scale = 1.4826*np.nanmedian(np.where(M, R, np.nan), axis=1);
+        with np.errstate(divide='ignore', invalid='ignore'):
+            W = M*np.minimum(1.0, np.nan_to_num(1.345*scale[:, None]/R, nan=1.0, posinf=1.0));
+        intercept, slope = weighted_line_fits(X, Y, W);
+
+    a = intercept;
+    if model == 'power':
+        a = np.exp(intercept);
+    return [pyr.pmap({'model': model, 'a': a[i], 'b': slope[i], 'points': int(M[i].sum())})
+            for i in range(0, count)];
+
+def predict(fit, sizes):
+    sizes = np.asarray(sizes, dtype=np.float64);
+    if fit['model'] == 'power':
+        return fit['a']*sizes**fit['b'];
+    return fit['a'] + fit['b']*sizes;
+
+# The sizes where the fitted curves of two series cross
+def crossovers(fits):
+    dst = [];
+    for i in range(0, len(fits)):
+        for j in range(i + 1, len(fits)):
+            fi = fits[i];
+            fj = fits[j];
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if fi['model'] == 'power':
+                    n = np.exp((np.log(fj['a']) - np.log(fi['a']))/(fi['b'] - fj['b']));
+                else:
+                    n = (fj['a'] - fi['a'])/(fi['b'] - fj['b']);
+            if np.isfinite(n) and 0 < n:
+                dst.append((i, j, float(n)));
+    return dst;
+
+def fit_sizes(extent, settings):
+    if settings['logx']:
+        return np.geomspace(extent[0], extent[1], 100);
+    return np.linspace(extent[0], extent[1], 100);
+
+@stages.stage('draw')
+def draw_fits(ax, lines, fits, crossings, extent, settings):
+    X = fit_sizes(extent, settings);
+    for line, fit in zip(lines, fits):
+        if np.isfinite(fit['b']):
+            ax.plot(X, predict(fit, X), color=line.get_color(), linestyle='--', linewidth=1);
+    for i, j, n in crossings:
+        if extent[0] <= n and n <= extent[1]:
+            ax.plot([n], predict(fits[i], [n]), 'x', color='black', markersize=8);
+
+# Fits with fewer than two points, or of sizes that are all the same,
+# are left out, as they are in the plot
+def fit_report(keys, fits, crossings, extent):
+    predicted_at = [float(x) for x in np.geomspace(extent[0], extent[1], 5)];
+    return {
+        'fits': {k: {'model': f['model'],
+                     'a': float(f['a']),
+                     'b': float(f['b']),
+                     'points': f['points'],
+                     'predicted': dict(zip([str(x) for x in predicted_at],
+                                           [optional_float(t) for t in predict(f, predicted_at)]))}
+                 for k, f in zip(keys, fits) if np.isfinite(f['a']) and np.isfinite(f['b'])},
+        'crossovers': [{'keys': [keys[i], keys[j]],
+                        'size': n,
+                        'seconds': float(predict(fits[i], [n])[0])}
+                       for i, j, n in crossings]
+    };
+
+
+
+###################################### Comparing two roots
+
+# Match the results of two roots by candidate and problem size, and compute
+# the time ratio candidate/baseline of every match, with a bootstrap
+# interval. A ratio above 1 + threshold is a regression. If both sides have
+# several samples, it must also be significant: the whole interval above 1.
+# Ratios that could not be computed are None in the comparison
+def optional_float(x):
+    return float(x) if math.isfinite(x) else None;
+
+def compare_stats(baseline, candidate, keys, threshold, settings):
+    rows = [];
+    for k in keys:
+        rb = candidate_rows(baseline, k);
+        rc = candidate_rows(candidate, k);
+        sizes, ib, ic = np.intersect1d(baseline['size'][rb], candidate['size'][rc],
+                                       return_indices=True);
+        rb = rb[ib];
+        rc = rc[ic];
+        ratio = time_ratios(candidate['median'][rc], baseline['median'][rb]);
+        boot = time_ratios(candidate['bootstrap'][rc], baseline['bootstrap'][rb]);
+        low, high = ratio_percentiles(boot, settings);
+        sampled = (1 < baseline['count'][rb]) & (1 < candidate['count'][rc]);
+        significant = sampled & ((1 < low) | (high < 1));
+        regression = (1 + threshold < ratio) & (significant | ~sampled);
+        for i in range(0, len(sizes)):
+            rows.append({'cand-key': k,
+                         'size': int(sizes[i]),
+                         'baseline-problem-index': int(baseline['problem-index'][rb[i]]),
+                         'candidate-problem-index': int(candidate['problem-index'][rc[i]]),
+                         'baseline-seconds': float(baseline['median'][rb[i]]),
+                         'candidate-seconds': float(candidate['median'][rc[i]]),
+                         'ratio': optional_float(ratio[i]),
+                         'ci-low': optional_float(low[i]),
+                         'ci-high': optional_float(high[i]),
+                         'count': int(min(baseline['count'][rb[i]], candidate['count'][rc[i]])),
+                         'significant': bool(significant[i]),
+                         'regression': bool(regression[i])});
+    return rows;
+
+# The two roots are bootstrapped with different seeds, so that their
+# resamples are independent.
+def compare_roots(baseline_root, candidate_root, keys, threshold, settings):
+    return compare_stats(sample_statistics(load_results(baseline_root), settings),
+                         sample_statistics(load_results(candidate_root),
+                                           settings.set('seed', settings['seed'] + 1)),
+                         keys, threshold, settings);
+
+# Line plot of the ratios, one line per candidate
+def render_ratioplot(rows, keys, names, settings):
+    series = [];
+    for k in reversed(keys):
+        rs = [r for r in rows if r['cand-key'] == k];
+        series.append((names.get(k, k), {
+            'size': np.array([r['size'] for r in rs]),
+            'median': np.array([r['ratio'] for r in rs], dtype=np.float64),
+            'ci-low': np.array([r['ci-low'] for r in rs], dtype=np.float64),
+            'ci-high': np.array([r['ci-high'] for r in rs], dtype=np.float64),
+            'count': np.array([r['count'] for r in rs], dtype=np.int64)}));
+    return save_lineplot(series,
+                         settings.set('logy', False).set('ylabel', 'Time ratio (candidate/baseline)'),
+                         "ratioplot.pdf", 1.0);
+
+
+
+###################################### Command line interface
+
+# One row per problem with the median time of every candidate, its
+# speedup relative to the baseline candidate, the fastest candidate and
+# the reasons why runs of the problem were noisy.
+def summarize(keys, root, baseline, settings):
+    loaded = as_loaded_root(root, settings);
+    problems = loaded['problems'];
+    table = loaded['table'];
+    stats = sample_statistics(table, settings);
+    noisy = noisy_runs(loaded.get('environment', []));
+    ppm = make_per_problem_map(stats);
+    median = stats['median'];
+    rows = [];
+    for prob in problems:
+        m = ppm.get(prob['index'], {});
+        times = {k: median[m[k]] for k in keys if k in m};
+        speedups = {};
+        if baseline in times:
+            speedups = {k: times[baseline]/t for k, t in times.items() if 0 < t};
+        fastest = None;
+        if 0 < len(times):
+            fastest = min(times, key=times.get);
+        run_ids = set(table['run-id'][table['by-problem'][prob['index']]].tolist());
+        rows.append({'index': prob['index'],
+                     'size': prob['size'],
+                     'times': times,
+                     'speedups': speedups,
+                     'fastest': fastest,
+                     'noisy': sorted(set(r for i in run_ids for r in noisy.get(i, [])))});
+    return rows;
+
+# The 'noisy' column is only shown if some problem has noisy runs
+def summary_columns(keys, baseline, noisy):
+    header = ['problem', 'size'];
+    header += [k + ' (s)' for k in keys];
+    if baseline != None:
+        header += [k + ' speedup' for k in keys];
+    header.append('fastest');
+    if noisy:
+        header.append('noisy');
+    return header;
+
+def summary_cells(row, keys, baseline, noisy):
+    def fmt(m, k, f):
+        return f.format(m[k]) if k in m else '';
+    cells = [str(row['index']), str(row['size'])];
+    cells += [fmt(row['times'], k, '{:.6g}') for k in keys];
+    if baseline != None:
+        cells += [fmt(row['speedups'], k, '{:.3g}') for k in keys];
+    cells.append(row['fastest'] or '');
+    if noisy:
+        cells.append(','.join(row['noisy']));
+    return cells;
+
+def format_summary(rows, keys, baseline, fmt):
+    noisy = any(0 < len(row['noisy']) for row in rows);
+    header = summary_columns(keys, baseline, noisy);
+    cells = [summary_cells(row, keys, baseline, noisy) for row in rows];
+    if fmt == 'csv':
+        import csv
+        import io
+        dst = io.StringIO();
+        w = csv.writer(dst, lineterminator='\n');
+        w.writerow(header);
+        w.writerows(cells);
+        return dst.getvalue();
+    if fmt == 'markdown':
+        lines = ['| ' + ' | '.join(header) + ' |',
+                 '|' + '|'.join(['---']*len(header)) + '|'];
+        lines += ['| ' + ' | '.join(c) + ' |' for c in cells];
+        return '\n'.join(lines) + '\n';
+    widths = [max(len(r[i]) for r in [header] + cells) for i in range(0, len(header))];
+    return ''.join('  '.join(c.rjust(w) for c, w in zip(r, widths)) + '\n'
+                   for r in [header] + cells);
+
+def compare_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjmark compare',
+        description='Compare the results of a candidate build against a baseline. '
+        'The exit status is 1 if there are regressions.');
+    parser.add_argument('baseline');
+    parser.add_argument('candidate');
+    parser.add_argument('--keys', help='Comma-separated candidate keys (default: those in both)');
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Smallest relative slowdown reported as a regression');
+    parser.add_argument('--report', help='Write the comparison as JSON to this file');
+    parser.add_argument('--plot', action='store_true', help='Render the ratio plot');
+    parser.add_argument('--outputprefix', default=default_settings['outputprefix']);
+    args = parser.parse_args(argv);
+
+    base_cands = load_candidates(args.baseline);
+    cand_cands = load_candidates(args.candidate);
+    keys = [k for k in base_cands if k in cand_cands];
+    if args.keys != None:
+        keys = args.keys.split(',');
+    settings = default_settings.set('outputprefix', args.outputprefix);
+    rows = compare_roots(args.baseline, args.candidate, keys, args.threshold, settings);
+    regressions = [r for r in rows if r['regression']];
+
+    def number(x):
+        return math.nan if x == None else x;
+    for r in rows:
+        flag = '';
+        if r['regression']:
+            flag = 'REGRESSION';
+        sys.stdout.write('{:>10s} {:>10d} {:>8.3f} [{:.3f}, {:.3f}] {:s}\n'.format(
+            r['cand-key'], r['size'], number(r['ratio']), number(r['ci-low']), number(r['ci-high']), flag));
+    sys.stdout.write('{:d} regressions in {:d} comparisons\n'.format(len(regressions), len(rows)));
+
+    if args.report != None:
+        with open(args.report, 'w') as f:
+            json.dump({'baseline': args.baseline,
+                       'candidate': args.candidate,
+                       'threshold': args.threshold,
+                       'confidence': settings['confidence'],
+                       'regressions': len(regressions),
+                       'rows': rows}, f, indent=1);
+    if args.plot:
+        names = {k: v['name'] for k, v in cand_cands.items()};
+        render_ratioplot(rows, keys, names, settings);
+    return 1 if 0 < len(regressions) else 0;
+
+def main(argv):
+    if 0 < len(argv) and argv[0] == 'compare':
+        return compare_main(argv[1:]);
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjmark',
+        description='Summarize the results of a benchmark root.');
+    parser.add_argument('root');
+    parser.add_argument('--keys', help='Comma-separated candidate keys (default: all)');
+    parser.add_argument('--baseline', help='Candidate key that speedups are relative to');
+    parser.add_argument('--format', choices=['text', 'csv', 'markdown'], default='text');
+    parser.add_argument('--output', help='Write the summary to this file instead of stdout');
+    parser.add_argument('--plot', action='store_true', help='Also render the bar and line plots');
+    parser.add_argument('--outputprefix', default=default_settings['outputprefix']);
+    parser.add_argument('--timing', action='store_true', help='Report startup and run time on stderr');
+    parser.add_argument('--normalize', action='store_true',
+                        help='Normalize the times of every run by its calibration score');
+    args = parser.parse_args(argv);
+
+    settings = default_settings.set('bootstrap', 0).set('outputprefix', args.outputprefix).set(
+        'normalize', args.normalize);
+    keys = list(load_candidates(args.root).keys());
+    if args.keys != None:
+        keys = args.keys.split(',');
+    baseline = args.baseline;
+    if baseline != None and not(baseline in keys):
+        parser.error('The baseline {:s} is not among the keys'.format(baseline));
+
+    begin = time.perf_counter();
+    text = format_summary(summarize(keys, args.root, baseline, settings), keys, baseline, args.format);
+    if args.output == None:
+        sys.stdout.write(text);
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text);
+
+    for run_id, reasons in sorted(noisy_runs(load_environment(args.root)).items()):
+        sys.stderr.write('Run {:d} is noisy: {:s}\n'.format(run_id, ', '.join(reasons)));
+
+    summarized = time.perf_counter();
+    if args.plot:
+        plot_settings = default_settings.set('outputprefix', args.outputprefix).set(
+            'normalize', args.normalize);
+        render_barplots(keys, args.root, plot_settings);
+        render_lineplot(keys, args.root, plot_settings);
+
+    if args.timing:
+        sys.stderr.write('startup {:.3f} s, summary {:.3f} s, plots {:.3f} s, matplotlib loaded: {}\n'.format(
+            begin - started, summarized - begin, time.perf_counter() - summarized,
+            'matplotlib' in sys.modules));
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
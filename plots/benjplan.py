@@ -0,0 +1,247 @@
+import benjmark
+import benjrun
+import pyrsistent as pyr
+import os
+import math
+import sys
+import numpy as np
+
+# Plans new problem sizes of a benchmark root from its results. Instead of
+# spending runs where the ranking of the candidates is obvious, new sizes
+# bisect, at the geometric mean,
+#
+#   - the intervals between two sizes where two candidates swap places
+#     (crossovers), and
+#   - the intervals next to a size where the times of a candidate are
+#     spread out, relative to their median (such as JIT warm-up).
+#
+# The time of running the candidates on a new size is estimated by
+# interpolating their median times plus the overhead of a run: Starting
+# the process, loading the problem, warming up and repeating. The overhead
+# is interpolated from the 'wall-seconds' that benjrun.py records, or else
+# taken to be 'overhead-seconds'. Sizes are added, crossovers first, as
+# long as the total estimate stays within 'budget-seconds'. Running the
+# planner again after the new problems have been run refines the plan.
+#
+# Example:
+#   python3 benjplan.py ../benchmarks/tempexpr --budget-seconds 300
+#   python3 benjplan.py ../benchmarks/tempexpr --budget-seconds 300 --generate tempexpr
+
+default_settings = pyr.pmap({
+    "budget-seconds": 600.0,
+    # Runs of every candidate on a new problem, as with benjrun --repetitions
+    "repetitions": 1,
+    "max-problems": 8,
+    # Overhead of one run of a candidate that has no recorded wall times
+    "overhead-seconds": 1.0,
+    # Smallest ratio of MAD to median that marks a size as spread out
+    "spread-threshold": 0.1,
+    # Intervals whose end sizes differ by a smaller factor are not bisected
+    "min-ratio": 1.1
+});
+
+def series_by_key(stats, keys):
+    dst = {};
+    for k in keys:
+        s = benjmark.get_sizes_and_stats(stats, k);
+        if 0 < len(s['size']):
+            dst[k] = s;
+    return dst;
+
+def bisect(a, b, settings):
+    if a <= 0 or b < a*settings['min-ratio']:
+        return None;
+    return int(round(math.sqrt(a*b)));
+
+def crossover_proposals(series, settings):
+    dst = [];
+    keys = list(series.keys());
+    for i, p in enumerate(keys):
+        for q in keys[i + 1:]:
+            sizes, ip, iq = np.intersect1d(series[p]['size'], series[q]['size'],
+                                           return_indices=True);
+            faster = series[p]['median'][ip] < series[q]['median'][iq];
+            for j in np.flatnonzero(faster[1:] != faster[:-1]):
+                size = bisect(sizes[j], sizes[j + 1], settings);
+                if size != None:
+                    dst.append({'size': size, 'reason': 'crossover ' + p + '/' + q});
+    return dst;
+
+def spread_proposals(series, settings):
+    dst = [];
+    for k, s in series.items():
+        sizes = s['size'];
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spread = s['mad']/s['median'];
+        for j in np.flatnonzero(settings['spread-threshold'] < spread):
+            for a, b in [(j - 1, j), (j, j + 1)]:
+                if 0 <= a and b < len(sizes):
+                    size = bisect(sizes[a], sizes[b], settings);
+                    if size != None:
+                        dst.append({'size': size, 'reason': 'spread ' + k});
+    return dst;
+
+# Estimated seconds of one run of a candidate at 'size', interpolating the
+# medians in log-log space
+def predict_seconds(s, size):
+    ok = (0 < s['size']) & (0 < s['median']);
+    if not(ok.any()):
+        return 0.0;
+    return float(np.exp(np.interp(math.log(size), np.log(s['size'][ok]), np.log(s['median'][ok]))));
+
+# The overhead of the runs of every candidate, as series of 'size' and
+# 'median' seconds beyond the time of the computation, from the results
+# with 'wall-seconds'
+def overhead_series(results, problems, keys):
+    sizes = {p['index']: p['size'] for p in problems};
+    samples = {};
+    for r in results:
+        if r['cand-key'] in keys and 'wall-seconds' in r and r['problem-index'] in sizes:
+            by_size = samples.setdefault(r['cand-key'], {});
+            by_size.setdefault(sizes[r['problem-index']], []).append(
+                r['wall-seconds'] - r['time-seconds']);
+    dst = {};
+    for k, by_size in samples.items():
+        ordered = sorted(by_size);
+        dst[k] = {'size': np.array(ordered),
+                  'median': np.array([np.median(by_size[n]) for n in ordered])};
+    return dst;
+
+def load_overheads(root, problems, keys):
+    filename = root + "/results.json";
+    if not(os.path.exists(filename)):
+        return {};
+    return overhead_series(benjmark.load_json_data(filename), problems, keys);
+
+# Estimated seconds of one run of every candidate at 'size'
+def run_seconds(series, overheads, size, settings):
+    total = 0.0;
+    for k, s in series.items():
+        total += predict_seconds(s, size);
+        if k in overheads:
+            total += predict_seconds(overheads[k], size);
+        else:
+            total += settings['overhead-seconds'];
+    return total;
+
+# The proposed sizes, in order of priority, each with the reasons for it
+# and its estimated cost in seconds. Sizes past the budget are left out.
+def plan(loaded, keys, settings=default_settings, overheads={}):
+    stats = benjmark.sample_statistics(loaded['table'], benjmark.default_settings.set('bootstrap', 0));
+    series = series_by_key(stats, keys);
+    existing = set(p['size'] for p in loaded['problems']);
+    proposals = {};
+    for p in crossover_proposals(series, settings) + spread_proposals(series, settings):
+        if not(p['size'] in existing):
+            proposals.setdefault(p['size'], []).append(p['reason']);
+
+    def priority(size):
+        reasons = proposals[size];
+        return (-sum(r.startswith('crossover') for r in reasons), -len(reasons), size);
+
+    dst = [];
+    total = 0.0;
+    for size in sorted(proposals, key=priority):
+        if settings['max-problems'] <= len(dst):
+            break;
+        cost = settings['repetitions']*run_seconds(series, overheads, size, settings);
+        if settings['budget-seconds'] < total + cost:
+            continue;
+        total += cost;
+        dst.append({'size': size, 'reasons': sorted(set(proposals[size])), 'seconds': cost});
+    return dst;
+
+###################################### Problem generators
+
+# Python counterparts of generate-problem in the Clojure benchmark
+# namespaces, taking a size and a NumPy random generator
+
+def tempexpr_problem(size, rng):
+    dim = 2;
+    return {'dim': dim, 'data': rng.random(dim*size).tolist()};
+
+def nbody_problem(size, rng):
+    return {'iterations': size, 'step-size': 0.01};
+
+# The ranges, noise and optimization of the circle problems, with the
+# 'count' of points given by the size
+circle_settings = {
+    'ranges': {'cx': [-1.0, 1.0], 'cy': [-1.0, 1.0], 'r': [0.5, 2.0]},
+    'noise': 0.1,
+    'step-size': 0.25,
+    'iterations': 30
+};
+
+def circle_params(rng):
+    ranges = circle_settings['ranges'];
+    return {k: rng.uniform(*ranges[k]) for k in ['cx', 'cy', 'r']};
+
+def circle_problem(size, rng):
+    settings = dict(circle_settings, count=size);
+    true_params = circle_params(rng);
+    angle = rng.uniform(0.0, 2.0*math.pi, size);
+    noise = settings['noise'];
+    points = np.stack([true_params['cx'] + true_params['r']*np.cos(angle),
+                       true_params['cy'] + true_params['r']*np.sin(angle)], axis=1);
+    points += rng.uniform(-noise, noise, points.shape);
+    return {'settings': settings,
+            'true-params': true_params,
+            'init-params': circle_params(rng),
+            'points': points.tolist()};
+
+generators = {'tempexpr': tempexpr_problem,
+              'nbody': nbody_problem,
+              'circle': circle_problem};
+
+# Append problems of the given sizes to a root, returning their indices
+def add_problems(root, sizes, generate, rng):
+    info = benjmark.load_json_data(root + "/probleminfo.json");
+    first = info['count'];
+    for i, size in enumerate(sizes):
+        benjrun.save_json_data(root + "/" + benjmark.problem_filename(first + i),
+                               {'size': size, 'data': generate(size, rng)});
+    benjrun.save_json_data(root + "/probleminfo.json", dict(info, count=first + len(sizes)));
+    return list(range(first, first + len(sizes)));
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjplan',
+        description='Propose problem sizes that bisect the crossovers and spread out regions '
+        'of a benchmark root, and optionally generate them.');
+    parser.add_argument('root');
+    parser.add_argument('--keys', help='Comma-separated candidate keys (default: all)');
+    parser.add_argument('--budget-seconds', type=float, default=default_settings['budget-seconds']);
+    parser.add_argument('--repetitions', type=int, default=default_settings['repetitions']);
+    parser.add_argument('--max-problems', type=int, default=default_settings['max-problems']);
+    parser.add_argument('--overhead-seconds', type=float, default=default_settings['overhead-seconds'],
+                        help='Overhead of a run of a candidate without recorded wall times');
+    parser.add_argument('--generate', choices=sorted(generators),
+                        help='Write the proposed problems with this generator');
+    parser.add_argument('--seed', type=int);
+    args = parser.parse_args(argv);
+
+    loaded = benjmark.load_root(args.root);
+    keys = list(loaded['candidates'].keys());
+    if args.keys != None:
+        keys = args.keys.split(',');
+    settings = default_settings.update({
+        'budget-seconds': args.budget_seconds,
+        'repetitions': args.repetitions,
+        'max-problems': args.max_problems,
+        'overhead-seconds': args.overhead_seconds
+    });
+    proposals = plan(loaded, keys, settings, load_overheads(args.root, loaded['problems'], keys));
+    for p in proposals:
+        sys.stdout.write('{:>10d} {:>10.3f} s  {:s}\n'.format(p['size'], p['seconds'], ', '.join(p['reasons'])));
+    sys.stdout.write('{:d} sizes, {:.3f} s estimated\n'.format(
+        len(proposals), sum(p['seconds'] for p in proposals)));
+
+    if args.generate != None and 0 < len(proposals):
+        indices = add_problems(args.root, [p['size'] for p in proposals],
+                               generators[args.generate], np.random.default_rng(args.seed));
+        sys.stdout.write('Added problems {:s}\n'.format(','.join(str(i) for i in indices)));
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,273 @@
+import benjmark
+import benjenv
+import pyrsistent as pyr
+import json
+import os
+import sys
+import shlex
+import time
+import queue
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+# Runs executable candidates on the problems of a benchmark root. Every
+# executable is called as
+#
+#   <command> <problem file> <output file>
+#
+# and writes an output JSON with 'time-seconds', 'output' and 'dry-output',
+# just like the C++ candidates built on bj::perform. The timings are merged
+# into the results.json of the root, one row per repetition.
+#
+# Every run is recorded in the environment.json of the root, with a
+# snapshot of the machine and a calibration score taken before and after
+# it (see benjenv.py). The rows of the run refer to it by 'run-id'.
+#
+# Example:
+#   python3 benjrun.py ../benchmarks/tempexpr --candidate cpp=../cpp/tempexpr --repetitions 5 --pin
+
+default_settings = pyr.pmap({
+    "repetitions": 1,
+    "jobs": 1,
+    "pin": False,
+    "cpus": None,
+    "max-duration-seconds": 60.0,
+    "problem-indices": None
+});
+
+def save_json_data(filename, data):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f);
+    os.replace(filename + '.tmp', filename);
+
+def load_results_data(root):
+    filename = root + "/results.json";
+    if os.path.exists(filename):
+        return benjmark.load_json_data(filename);
+    return [];
+
+def load_candidates_data(root):
+    filename = root + "/candidates.json";
+    if os.path.exists(filename):
+        return benjmark.load_candidates(root);
+    return {};
+
+# Run a candidate once. Returns the output JSON, or None if the run
+# exceeded the timeout. A candidate that fails raises CalledProcessError,
+# and one that writes no valid output raises ValueError.
+def run_once(command, problem_file, timeout, cpu):
+    fd, output_file = tempfile.mkstemp(suffix='.json');
+    os.close(fd);
+    try:
+        start = time.perf_counter();
+        with subprocess.Popen(command + [problem_file, output_file],
+                              stdout=subprocess.DEVNULL) as proc:
+            # Pinned from here rather than in a preexec_fn, which is not
+            # safe in the threads of the jobs. The candidate is pinned
+            # before it has loaded the problem.
+            if cpu != None:
+                try:
+                    os.sched_setaffinity(proc.pid, {cpu});
+                except ProcessLookupError:
+                    pass;
+            try:
+                returncode = proc.wait(timeout=timeout);
+            except subprocess.TimeoutExpired:
+                proc.kill();
+                return None;
+        wall = time.perf_counter() - start;
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, proc.args);
+        return dict(benjmark.load_json_data(output_file), **{'wall-seconds': wall});
+    finally:
+        os.remove(output_file);
+
+# The cores that the jobs run on
+def job_cpus(settings):
+    cpus = settings['cpus'];
+    if cpus == None:
+        cpus = sorted(os.sched_getaffinity(0));
+    return cpus[0:max(1, settings['jobs'])];
+
+# The cores that the candidates may use: Those of the jobs if they are
+# pinned, or else any core of this process
+def used_cpus(settings):
+    if settings['pin']:
+        return job_cpus(settings);
+    return sorted(os.sched_getaffinity(0));
+
+def make_state(root, commands, settings, run_id):
+    free_cpus = queue.Queue();
+    for cpu in job_cpus(settings):
+        free_cpus.put(cpu);
+    return {'root': root,
+            'commands': commands,
+            'settings': settings,
+            'lock': threading.Lock(),
+            'results': load_results_data(root),
+            'run-id': run_id,
+            'too-slow': {},
+            'cpus': free_cpus};
+
+# Once a candidate has exceeded the maximum duration for some size,
+# it is not run on larger problems.
+def should_run(state, key, size):
+    limit = state['too-slow'].get(key);
+    return limit == None or size < limit;
+
+def mark_too_slow(state, key, size):
+    with state['lock']:
+        state['too-slow'][key] = min(size, state['too-slow'].get(key, size));
+
+# Outputs with 'time-samples', such as those of python/bj.py, keep their
+# samples in the row of the repetition. 'wall-seconds' is the time of the
+# whole process, including start-up, loading and warm-up.
+def result_row(problem_index, key, output, run_id):
+    row = {'problem-index': problem_index,
+           'cand-key': key,
+           'time-seconds': output['time-seconds'],
+           'wall-seconds': output['wall-seconds'],
+           'run-id': run_id};
+    if 'time-samples' in output:
+        row['time-samples'] = output['time-samples'];
+    return row;
+
+def store_times(state, problem_index, key, outputs):
+    with state['lock']:
+        results = [r for r in state['results']
+                   if not(r['problem-index'] == problem_index and r['cand-key'] == key)];
+        results += [result_row(problem_index, key, output, state['run-id']) for output in outputs];
+        state['results'] = results;
+        save_json_data(state['root'] + "/results.json", results);
+
+def run_task(state, problem, key):
+    size = problem['size'];
+    if not(should_run(state, key, size)):
+        return (problem['index'], key, 'skipped');
+    settings = state['settings'];
+    max_duration = settings['max-duration-seconds'];
+    problem_file = state['root'] + '/' + benjmark.problem_filename(problem['index']);
+    cpu = state['cpus'].get();
+    outputs = [];
+    failure = None;
+    try:
+        for i in range(0, settings['repetitions']):
+            output = run_once(state['commands'][key], problem_file, max_duration,
+                              cpu if settings['pin'] else None);
+            if output == None:
+                mark_too_slow(state, key, size);
+                break;
+            seconds = output['time-seconds'];
+            outputs.append(output);
+            if max_duration != None and max_duration < seconds:
+                mark_too_slow(state, key, size);
+                break;
+    except subprocess.CalledProcessError as e:
+        failure = 'failed with exit status {:d}'.format(e.returncode);
+    except ValueError:
+        failure = 'failed to write its output';
+    except KeyError:
+        failure = 'wrote no time-seconds';
+    except OSError as e:
+        failure = 'could not be run: {:s}'.format(str(e));
+    finally:
+        state['cpus'].put(cpu);
+    if 0 < len(outputs):
+        store_times(state, problem['index'], key, outputs);
+    if failure != None:
+        return (problem['index'], key, failure);
+    return (problem['index'], key, [output['time-seconds'] for output in outputs]);
+
+# The problems are visited in order of increasing size. With 'jobs' larger
+# than one, independent problems run at the same time, each on a core of
+# its own.
+def run_tasks(state):
+    settings = state['settings'];
+    problems = benjmark.load_problems(state['root']);
+    indices = settings['problem-indices'];
+    if indices != None:
+        problems = [p for p in problems if p['index'] in indices];
+    problems = sorted(problems, key=lambda p: p['size']);
+    tasks = [(p, k) for p in problems for k in state['commands']];
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, settings['jobs'])) as pool:
+        futures = [pool.submit(run_task, state, p, k) for (p, k) in tasks];
+        for f in futures:
+            index, key, times = f.result();
+            print('Problem {:d} {:s}: {}'.format(index, key, times));
+    return state['results'];
+
+def update_candidates(root, names):
+    candidates = load_candidates_data(root);
+    for key, name in names.items():
+        entry = dict(candidates.get(key, {}));
+        entry.setdefault('name', name);
+        candidates[key] = entry;
+    save_json_data(root + "/candidates.json", candidates);
+
+def run_benchmark(root, commands, settings=default_settings, names={}):
+    update_candidates(root, {k: names.get(k, k) for k in commands});
+    environment = benjmark.load_environment(root);
+    run_id = max([r['run-id'] for r in environment], default=-1) + 1;
+    before = benjenv.capture();
+    try:
+        return run_tasks(make_state(root, commands, settings, run_id));
+    finally:
+        record = {'run-id': run_id,
+                  'candidates': sorted(commands),
+                  'cpus': used_cpus(settings),
+                  'before': before,
+                  'after': benjenv.capture()};
+        save_json_data(root + "/" + benjenv.environment_filename, environment + [record]);
+        reasons = benjenv.noise_reasons(record);
+        if 0 < len(reasons):
+            print('Run {:d} is noisy: {:s}'.format(run_id, ', '.join(reasons)));
+
+def parse_assignment(parser, text):
+    if not('=' in text):
+        parser.error('Expected KEY=VALUE, got ' + text);
+    return text.split('=', 1);
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='benjrun',
+        description='Run executable candidates on the problems of a benchmark root.');
+    parser.add_argument('root');
+    parser.add_argument('--candidate', action='append', default=[], metavar='KEY=COMMAND',
+                        help='Candidate key and the command that runs it');
+    parser.add_argument('--name', action='append', default=[], metavar='KEY=NAME',
+                        help='Display name of a new candidate');
+    parser.add_argument('--repetitions', type=int, default=default_settings['repetitions']);
+    parser.add_argument('--jobs', type=int, default=default_settings['jobs'],
+                        help='Number of problems run at the same time, each on its own core');
+    parser.add_argument('--pin', action='store_true', help='Pin every run to a single core');
+    parser.add_argument('--cpus', help='Comma-separated cores to run on');
+    parser.add_argument('--max-duration-seconds', type=float,
+                        default=default_settings['max-duration-seconds']);
+    parser.add_argument('--problems', help='Comma-separated problem indices');
+    args = parser.parse_args(argv);
+
+    if len(args.candidate) == 0:
+        parser.error('No candidates given');
+    commands = {k: shlex.split(c) for k, c in
+                (parse_assignment(parser, a) for a in args.candidate)};
+    names = dict(parse_assignment(parser, a) for a in args.name);
+
+    settings = default_settings.update({
+        'repetitions': args.repetitions,
+        'jobs': args.jobs,
+        'pin': args.pin,
+        'max-duration-seconds': args.max_duration_seconds
+    });
+    if args.cpus != None:
+        settings = settings.set('cpus', [int(c) for c in args.cpus.split(',')]);
+    if args.problems != None:
+        settings = settings.set('problem-indices', [int(i) for i in args.problems.split(',')]);
+
+    run_benchmark(args.root, commands, settings, names);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
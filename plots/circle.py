@@ -1,9 +1,16 @@
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import numpy as np
 import pyrsistent as pyr
+import os
+import sys
 import json
 import math
+import hashlib
+import plotbuild
+import stages
+import figureoutput
 
 ###################################### Functions
 
@@ -21,8 +28,12 @@ default_settings = pyr.pmap({
     'head_width': 0.1,
     'step_size': 0.5,
     'min_arrow_length': 0.2,
-    'iterations': 16
-});
+    'iterations': 16,
+    'frameformat': 'pdf',
+    'fps': 4
+}).update(figureoutput.default_settings).update(figureoutput.flags(sys.argv));
+
+plotbuild.init(sys.argv);
 
 font = {'family' : 'normal',
         'weight' : 'normal',
@@ -32,51 +43,53 @@ matplotlib.rc('font', **font)
 
 
 def split_coords(coords):
-    n = len(coords);
-    if n == 0:
+    if len(coords) == 0:
         return None;
-
-    dim = len(coords[0]);
-    dst = [];
-    for i in range(0, dim):
-        X = [];
-        for j in range(0, n):
-            X.append(coords[j][i]);
-        dst.append(X);
-    return dst;
+    return list(np.asarray(coords).T);
 
 def plot_points(ax, points, settings):
-    s = split_coords(points);
-    ax.plot(s[0], s[1], 'o', color=settings['pointcolor']);
+    P = np.asarray(points);
+    figureoutput.layer(ax.plot(P[:, 0], P[:, 1], 'o', color=settings['pointcolor']),
+                       'points', settings);
 
-def plot_circle_cost(ax, params, settings):
+def circle_cost_position(params, settings):
     cx = params['cx'];
     cy = params['cy'];
     r = params['r'];
     angle = settings['costangle'];
-    x = cx + r*math.cos(angle);
-    y = cy + r*math.sin(angle);
-    ax.text(x, y, "cost=" + settings['costfmt'].format(params['cost']), 
-            fontsize=settings['fontsize'],
-            color=settings['color'])
+    return (cx + r*math.cos(angle), cy + r*math.sin(angle));
+
+def circle_cost_text(params, settings):
+    return "cost=" + settings['costfmt'].format(params['cost']);
+
+def plot_circle_cost(ax, params, settings):
+    x, y = circle_cost_position(params, settings);
+    return ax.text(x, y, circle_cost_text(params, settings), 
+                   fontsize=settings['fontsize'],
+                   color=settings['color'])
+
+# The parameters of circles as an array with one row (cx, cy, r) per circle
+def params_array(samples):
+    return np.array([[p['cx'], p['cy'], p['r']] for p in samples], dtype=np.float64).reshape(-1, 3);
+
+# The outlines of all circles at once, an array of shape (circles x n x 2).
+# The last vertex of every outline is the same as the first one.
+def circle_outlines(P, n=100):
+    P = np.asarray(P, dtype=np.float64);
+    angles = np.linspace(0.0, 2.0*math.pi, n);
+    unit = np.stack([np.cos(angles), np.sin(angles)], axis=1);
+    return P[:, None, 0:2] + P[:, None, 2:3]*unit[None, :, :];
+
+# Draw many circles as a single collection. The 'colors' are either one
+# color for all circles or one per circle.
+def plot_circles(ax, P, colors, settings):
+    lines = LineCollection(circle_outlines(P), colors=colors, zorder=2);
+    ax.add_collection(lines);
+    ax.autoscale_view();
+    return lines;
 
 def plot_circle(ax, params, settings):
-    n = 100;
-    X = [];
-    Y = [];
-    step = 2.0*math.pi/(n - 1);
-    cx = params['cx'];
-    cy = params['cy'];
-    r = params['r'];
-    for i in range(0, n):
-        angle = i*step;
-        X.append(cx + r*math.cos(angle));
-        Y.append(cy + r*math.sin(angle));
-    color = settings.get('circlecolor');
-    if color == None:
-        return ax.plot(X, Y);
-    else:
-        return ax.plot(X, Y, color=color);
+    return plot_circles(ax, params_array([params]), settings.get('circlecolor', 'C0'), settings);
 
 def point_str(xlab, ylab, xval, yval, with_values):
     base = '(' + xlab + ', ' + ylab + ')';
@@ -113,15 +126,21 @@ def plot_position_gradient(ax, params, settings):
              head_width=settings['head_width']
     );
 
+def position_step(params, settings):
+    grad = params['gradient'];
+    alpha = settings['step_size'];
+    return (-alpha*grad['cx'], -alpha*grad['cy']);
+
+def is_step_shown(params, settings):
+    gx, gy = position_step(params, settings);
+    return settings['min_arrow_length'] <= math.sqrt(gx*gx + gy*gy);
+
 def plot_position_step(ax, params, settings, show_text):
     cx = params['cx'];
     cy = params['cy'];
-    grad = params['gradient'];
-    alpha = settings['step_size'];
-    gx = -alpha*grad['cx'];
-    gy = -alpha*grad['cy'];
+    gx, gy = position_step(params, settings);
 
-    if math.sqrt(gx*gx + gy*gy) < settings['min_arrow_length']:
+    if not(is_step_shown(params, settings)):
         return;
 
     color = settings['annotcolor'];
@@ -155,8 +174,8 @@ def plot_circle_params(ax, params, settings, with_values):
     ax.text(rx, ry, val_str('r', r, with_values), color=color);
 
 def plot_circle_with_cost(ax, params, settings):
-    [circle] = plot_circle(ax, params, settings);
-    plot_circle_cost(ax, params, settings.set('color', circle.get_color()));
+    circle = plot_circle(ax, params, settings);
+    plot_circle_cost(ax, params, settings.set('color', tuple(circle.get_color()[0])));
 
 def finish_plot(ax, settings):
     ax.axis('equal');
@@ -168,13 +187,77 @@ def make_plot():
     ax = fig.add_subplot(1, 1, 1);
     return (fig, ax);
 
-def plot_sample_cost(data, settings, sample):
+###################################### Frames
+
+# A sequence of circles over the same points, such as the steps of the
+# gradient descent, is rendered in a single figure: The points and the
+# axes are drawn once and only the circle, its cost and the step arrow are
+# updated from one frame to the next. All frames share the same limits.
+@stages.stage('draw')
+def make_frame(data, param_seq, settings):
     fig, ax = make_plot();
     plot_points(ax, data['points'], settings);
-    plot_circle_with_cost(ax, sample, settings);
+    P = params_array(param_seq);
+    circle = plot_circles(ax, P[0:1], settings.get('circlecolor', 'C0'), settings);
+    cost = ax.text(0.0, 0.0, '', fontsize=settings['fontsize'],
+                   color=tuple(circle.get_color()[0]));
+    # Placed at the first circle, so that it does not widen the data limits
+    arrow = ax.arrow(param_seq[0]['cx'], param_seq[0]['cy'], 0.0, 0.0,
+                     color=settings['annotcolor'], head_width=settings['head_width']);
+    ax.update_datalim(circle_outlines(P).reshape(-1, 2));
+    ax.autoscale_view();
     finish_plot(ax, settings);
-    return fig;
-    
+    return {'fig': fig, 'circle': circle, 'cost': cost, 'arrow': arrow};
+
+@stages.stage('draw')
+def update_frame(frame, params, settings, show_step):
+    frame['circle'].set_segments(circle_outlines(params_array([params])));
+    frame['cost'].set_position(circle_cost_position(params, settings));
+    frame['cost'].set_text(circle_cost_text(params, settings));
+    gx, gy = position_step(params, settings);
+    frame['arrow'].set_data(x=params['cx'], y=params['cy'], dx=gx, dy=gy);
+    frame['arrow'].set_visible(show_step and is_step_shown(params, settings));
+
+# Save the frames of 'param_seq' in one pass, depending on 'frameformat':
+#
+#   'pdf'        One file per frame, <basename>00.pdf, <basename>01.pdf, ...
+#   'multipage'  A single PDF with one page per frame, <basename>.pdf
+#   'gif', 'mp4' An animation with 'fps' frames per second, <basename>.gif
+#
+# Returns the names of the files written.
+def save_frames(data, param_seq, settings, show_step, basename):
+    frame = make_frame(data, param_seq, settings);
+    fig = frame['fig'];
+    fmt = settings['frameformat'];
+    if fmt == 'pdf':
+        gen = filename_generator(basename + '{:02d}.pdf');
+        dst = [];
+        for params in param_seq:
+            update_frame(frame, params, settings, show_step);
+            dst += figureoutput.save(fig, gen(), settings);
+        return dst;
+    filename = basename + '.' + ('pdf' if fmt == 'multipage' else fmt);
+    if fmt == 'multipage':
+        from matplotlib.backends.backend_pdf import PdfPages
+        writer = PdfPages(filename);
+        grab = lambda: writer.savefig(fig, dpi=settings['dpi']);
+        close = writer.close;
+    else:
+        import matplotlib.animation as animation
+        writers = {'gif': animation.PillowWriter, 'mp4': animation.FFMpegWriter};
+        if not(fmt in writers):
+            raise ValueError('Unknown frame format: ' + str(fmt));
+        writer = writers[fmt](fps=settings['fps']);
+        writer.setup(fig, filename, dpi=settings['dpi']);
+        grab = writer.grab_frame;
+        close = writer.finish;
+    try:
+        for params in param_seq:
+            update_frame(frame, params, settings, show_step);
+            grab();
+    finally:
+        close();
+    return [filename];
 
 def filename_generator(fmt):
     filename_generator.counter = 0;
@@ -187,11 +270,8 @@ def filename_generator(fmt):
 
 
 def optimization_illustrations(data, settings, inds):
-    gen = filename_generator(settings['outputpath'] + '/optillu{:02d}.pdf');
-    for i in inds:
-        sample = data['samples'][i];
-        plot_sample_cost(data, settings, sample).savefig(gen());
-    plot_sample_cost(data, settings, data['opt_params']).savefig(gen());
+    param_seq = [data['samples'][i] for i in inds] + [data['opt_params']];
+    return save_frames(data, param_seq, settings, False, settings['outputpath'] + '/optillu');
     
 
 def noninteractive(s):
@@ -201,7 +281,7 @@ def point_illustration(data, settings):
     fig, ax = make_plot();
     plot_points(ax, data['points'], settings);
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/problem.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/problem.pdf', settings);
     
 def point_and_circle_illustration(data, settings0):
     fig, ax = make_plot();
@@ -211,7 +291,7 @@ def point_and_circle_illustration(data, settings0):
     plot_circle(ax, params, settings);
     plot_circle_params(ax, params, settings, True);
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/problemsolved.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/problemsolved.pdf', settings);
 
 
 def problem_illustrations(data, settings):
@@ -267,42 +347,30 @@ def select_good_opt_sample(data):
         best = select_opt_sample(best, sample);
     return best;
     
-def eval_pt(d, x):
-    return d[0]*x[0] + d[1]*x[1];
-
-def select_point(d, a, b):
-    if a == None:
-        return b;
-
-    if eval_pt(d, a) < eval_pt(d, b):
-        return b;
-    else:
-        return a;
-
-
-
 def select_good_point(data, opt_sample):
     init = opt_sample_initial(opt_sample);
     params = data['params'];
     dx = params['cx'] - init['cx'];
     dy = params['cy'] - init['cy'];
-    best = None;
-    for pt in data['points']:
-        best = select_point([dx, dy], best, pt);
-    return best;
+    P = data['points'];
+    return P[int(np.argmax(P @ np.array([dx, dy])))];
+
+# The segments (points x 2 x 2) from the closest points on the circle to
+# the points
+def residual_segments(params, points):
+    P = np.asarray(points, dtype=np.float64).reshape(-1, 2);
+    c = np.array([params['cx'], params['cy']]);
+    d = P - c;
+    f = params['r']/np.sqrt((d*d).sum(axis=1));
+    return np.stack([c + f[:, None]*d, P], axis=1);
+
+def plot_residuals(ax, params, points):
+    lines = LineCollection(residual_segments(params, points), colors='red', zorder=2);
+    ax.add_collection(lines);
+    return lines;
 
 def error_line(ax, params, pt):
-    ptx = pt[0];
-    pty = pt[1];
-    cx = params['cx'];
-    cy = params['cy'];
-    dx = ptx - cx;
-    dy = pty - cy;
-    f = 1.0/math.sqrt(dx*dx + dy*dy);
-    rf = f*params['r'];
-    x = cx + rf*dx;
-    y = cy + rf*dy;
-    ax.plot([x, ptx], [y, pty], 'red');
+    return plot_residuals(ax, params, [pt]);
 
 def plot_single_point(data, settings):
     opt_sample = select_good_opt_sample(data);
@@ -321,7 +389,7 @@ def plot_single_point(data, settings):
             verticalalignment='top');
     error_line(ax, params, pt);
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/singlepoint.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/singlepoint.pdf', settings);
     
 def plot_multiple_points(data, settings):
     opt_sample = select_good_opt_sample(data);
@@ -332,10 +400,10 @@ def plot_multiple_points(data, settings):
     plot_points(ax, points, settings);
     plot_circle(ax, params, settings);
     plot_circle_params(ax, params, settings, False);
-    for pt in points:
-        error_line(ax, params, pt);
+    with stages.span('draw'):
+        figureoutput.layer(plot_residuals(ax, params, points), 'residuals', settings);
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/multiplepoint.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/multiplepoint.pdf', settings);
 
 def gradient_illustration(data, settings):
     points = data['points'];
@@ -350,7 +418,7 @@ def gradient_illustration(data, settings):
     plot_position_gradient(ax, params, settings);
     
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/gradient.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/gradient.pdf', settings);
 
 def step_illustration(data, settings):
     points = data['points'];
@@ -364,46 +432,26 @@ def step_illustration(data, settings):
     #plot_circle_center(ax, params, settings);
     plot_position_step(ax, params, settings, True);
     finish_plot(ax, settings);
-    fig.savefig(settings['outputpath'] + '/step.pdf');
+    figureoutput.save(fig, settings['outputpath'] + '/step.pdf', settings);
 
 def gradient_descent(data, settings):
     settings = settings.set('costfmt', '{:0.3f}');
-    gen = filename_generator(settings['outputpath'] + '/descent{:02d}.pdf');
-    points = data['points'];
     opt_sample = select_good_opt_sample(data)[0:settings['iterations']];
     for s in opt_sample:
         print('The cost is: ' + str(s['cost']));
-
-    for params in opt_sample:
-        fig, ax = make_plot();
-        plot_points(ax, points, settings);
-        plot_circle_with_cost(ax, params, settings);
-        plot_position_step(ax, params, settings, False);
-        finish_plot(ax, settings);
-        fig.savefig(gen());
-    
+    return save_frames(data, opt_sample, settings, True, settings['outputpath'] + '/descent');
 
 
-def select_best(a, b):
-    if a == None:
-        return b;
-    elif a['cost'] > b['cost']:
-        return b;
-    return a;
 
 def naive_opt_illustration(data, settings, n):
     fig, ax = make_plot();
     
-    samples = data['samples'];
+    samples = data['samples'][0:n];
     
-    circle_settings = settings.set('circlecolor', 'lightgray');
-
-    best = None;
-    for i in range(0, n):
-        params = samples[i];
-        plot_circle(ax, params, circle_settings);
-        
-        best = select_best(best, params);
+    with stages.span('draw'):
+        figureoutput.layer(plot_circles(ax, params_array(samples), 'lightgray', settings),
+                           'circles', settings);
+    best = samples[int(np.argmin([p['cost'] for p in samples]))];
     plot_points(ax, data['points'], settings.set('pointcolor', 'blue'));
     plot_circle_with_cost(ax, best, 
                           settings
@@ -416,37 +464,72 @@ def naive_opt_illustration(data, settings, n):
 def naive_opt_illustrations(data, settings, counts):
     gen = filename_generator(settings['outputpath'] + '/naiveopt{:02d}.pdf');
     for n in counts:
-        naive_opt_illustration(data, settings, n).savefig(gen());
+        figureoutput.save(naive_opt_illustration(data, settings, n), gen(), settings);
 
 
 ###################################### The code
 
-with open('../circledata/samples.json') as f:
-    data = json.load(f)
+samples_file = '../circledata/samples.json';
+
+def file_hash(filename):
+    h = hashlib.sha1();
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block);
+    return h.hexdigest();
+
+def cache_filename(json_file):
+    return os.path.splitext(json_file)[0] + '.npz';
+
+# The samples with the points as an (n x 2) array. The points and the
+# remaining JSON are cached in an .npz file next to the JSON file, which
+# is used as long as the hash of the JSON file matches.
+@stages.stage('load')
+def load_data(json_file):
+    sha1 = file_hash(json_file);
+    cache_file = cache_filename(json_file);
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cache:
+            if str(cache['sha1']) == sha1:
+                data = json.loads(cache['meta'].tobytes().decode('utf-8'));
+                data['points'] = cache['points'];
+                return data;
+    with open(json_file) as f:
+        data = json.load(f);
+    points = np.ascontiguousarray(data.pop('points'), dtype=np.float64).reshape(-1, 2);
+    meta = np.frombuffer(json.dumps(data).encode('utf-8'), dtype=np.uint8);
+    np.savez(cache_file, sha1=np.array(sha1), meta=meta, points=points);
+    data['points'] = points;
+    return data;
+
+data = load_data(samples_file);
 check_opt_samples(data, default_settings);
 #print(select_good_opt_sample(data)[0]);
 
+def build(name, render, *values):
+    plotbuild.step('circle-' + name, render, [samples_file], [default_settings] + list(values));
+
 ## Just showing the problem we want to sovle
-problem_illustrations(data, default_settings);
+build('problem', lambda: problem_illustrations(data, default_settings));
 
 ## Showing what we mean by optimization
-optimization_illustrations(data, default_settings, [1, 2, 3, 4]);
+build('optimization', lambda: optimization_illustrations(data, default_settings, [1, 2, 3, 4]), [1, 2, 3, 4]);
 
 ## Showing the cost for a single point
-plot_single_point(data, default_settings);
+build('singlepoint', lambda: plot_single_point(data, default_settings));
 
 ## Showing the costs of multiple points
-plot_multiple_points(data, default_settings);
+build('multiplepoint', lambda: plot_multiple_points(data, default_settings));
 
 ## How naive optimization would work
-naive_opt_illustrations(data, default_settings, [1, 5, 10, 20, 40, 80, 100]);
+build('naiveopt', lambda: naive_opt_illustrations(data, default_settings, [1, 5, 10, 20, 40, 80, 100]),
+      [1, 5, 10, 20, 40, 80, 100]);
 
 ## What the gradient looks like
-gradient_illustration(data, default_settings);
+build('gradient', lambda: gradient_illustration(data, default_settings));
 
 ## What the step looks like
-step_illustration(data, default_settings);
+build('step', lambda: step_illustration(data, default_settings));
 
 ## What gradient descent looks like
-gradient_descent(data, default_settings);
-
+build('descent', lambda: gradient_descent(data, default_settings));
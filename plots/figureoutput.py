@@ -0,0 +1,56 @@
+import os
+import pyrsistent as pyr
+
+# How the figures are written. The data layers of a figure have names, and
+# the layers listed in 'rasterize' are embedded as images of 'dpi' dots per
+# inch, while the axes, text and other layers stay vector graphics. This
+# keeps figures with many vertices small and fast to save and display.
+# With 'png', every figure is also saved as a PNG next to the PDF.
+#
+# The layers are
+#   points        Point clouds (circle.py, nbody_plot.py)
+#   circles       Sampled circles (circle.py)
+#   residuals     Point to circle segments (circle.py)
+#   trajectories  Body trajectories (nbody_plot.py)
+#   connections   Lines between bodies (nbody_plot.py)
+#   lines, bars   Line and bar plots (benjmark.py)
+#
+# Every plot script applies the flags of its command line with 'flags'
+#   --rasterize   Rasterize all layers
+#   --png         Also save PNG files
+
+all_layers = pyr.pset(['points', 'circles', 'residuals', 'trajectories',
+                       'connections', 'lines', 'bars']);
+
+default_settings = pyr.pmap({
+    'rasterize': pyr.pset(),
+    'dpi': 200,
+    'png': False
+});
+
+# The settings given by the flags in argv, to update other settings with
+def flags(argv):
+    dst = pyr.pmap();
+    if '--rasterize' in argv:
+        dst = dst.set('rasterize', all_layers);
+    if '--png' in argv:
+        dst = dst.set('png', True);
+    return dst;
+
+# Mark the artists of a layer for rasterization, if the settings say so
+def layer(artists, name, settings):
+    rasterized = name in settings['rasterize'];
+    for artist in (artists if isinstance(artists, (list, tuple)) else [artists]):
+        artist.set_rasterized(rasterized);
+    return artists;
+
+def png_filename(filename):
+    return os.path.splitext(filename)[0] + '.png';
+
+# Save a figure, returning the names of the files written
+def save(fig, filename, settings):
+    fig.savefig(filename, dpi=settings['dpi']);
+    if not(settings['png']):
+        return [filename];
+    fig.savefig(png_filename(filename), dpi=settings['dpi']);
+    return [filename, png_filename(filename)];
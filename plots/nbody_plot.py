@@ -1,13 +1,34 @@
 import pyrsistent as pyr
 import json
+import sys
 import matplotlib
 import matplotlib.pyplot as plt
 import math
+import functools
 from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+import numpy as np
+import plotbuild
+import trajstore
+import spatial
+import stages
+import figureoutput
 
-states = None;
-with open('../benchmarks/nbody/stateseq.json') as f:
-    states = json.load(f);
+plotbuild.init(sys.argv);
+
+states_file = '../benchmarks/nbody/stateseq.json';
+
+# The states as memory mapped arrays, see trajstore.py. They are only
+# loaded by the plots that are rendered.
+@functools.lru_cache(maxsize=None)
+def load_traj():
+    with stages.span('load'):
+        return trajstore.load_or_convert(states_file);
+
+def state_at(traj, index):
+    return {'names': traj['names'],
+            'pos': traj['pos'][index],
+            'vel': traj['vel'][index]};
 
 def make_plot():
     fig = plt.figure();
@@ -19,91 +40,98 @@ fs = 12;
 ms = 60;
 lw = 1;
 
+# Rasterization and PNG export, see figureoutput.py
+output = figureoutput.default_settings.update(figureoutput.flags(sys.argv));
+
 def render_planets(ax, state):
-    X = [];
-    Y = [];
-    Z = [];
-    for k in state:
-        body = state[k]
-        pos = body['pos'];
-        x = pos[0];
-        y = pos[1];
-        z = pos[2];
-        X.append(x);
-        Y.append(y);
-        Z.append(z);
-        ax.text(x, y, z, k.capitalize(), fontsize=fs)
-    ax.scatter(X, Y, Z, color='blue', s=ms)
-
-def render_connections(ax, state):
-    for i in state:
-        a = state[i];
-        for j in state:
-            b = state[j];
-            
-            apos = a['pos']
-            bpos = b['pos']
-            
-            X = [apos[0], bpos[0]]
-            Y = [apos[1], bpos[1]]
-            Z = [apos[2], bpos[2]]
-
-            ax.plot(X, Y, Z, color='red', linewidth=lw)
+    P = state['pos'];
+    for k, p in zip(state['names'], P):
+        ax.text(p[0], p[1], p[2], k.capitalize(), fontsize=fs)
+    figureoutput.layer(ax.scatter(P[:, 0], P[:, 1], P[:, 2], color='blue', s=ms), 'points', output)
+
+# Which pairs of bodies are connected: All of them, those closer than
+# 'cutoff' or each body and its 'neighbours' nearest bodies.
+connections = pyr.pmap({'cutoff': None, 'neighbours': None});
+
+@stages.stage('pairs')
+def connection_pairs(P, settings):
+    if settings['cutoff'] != None:
+        return spatial.cutoff_pairs(P, settings['cutoff']);
+    if settings['neighbours'] != None:
+        return spatial.knn_pairs(P, settings['neighbours']);
+    return spatial.unique_pairs(len(P));
+
+# All connections are drawn as a single collection, each pair once
+def render_connections(ax, state, settings=connections):
+    P = np.asarray(state['pos']);
+    I, J = connection_pairs(P, settings);
+    segments = np.stack([P[I], P[J]], axis=1);
+    lines = Line3DCollection(segments, colors='red', linewidths=lw);
+    ax.add_collection3d(figureoutput.layer(lines, 'connections', output));
 
 def render_velocities(ax, state, alpha):
-    for k in state:
-        body = state[k]
-        pos = body['pos']
-        vel = body['vel']
+    for pos, vel in zip(state['pos'], state['vel']):
         X = [pos[0], pos[0] + alpha*vel[0]];
         Y = [pos[1], pos[1] + alpha*vel[1]];
         Z = [pos[2], pos[2] + alpha*vel[2]];
         ax.plot(X, Y, Z, color='red', linewidth=lw);
 
-def render_trajectories(ax, states):
-    first_state = states[0];
-    for k in first_state:
-        X = [];
-        Y = [];
-        Z = [];
-        for state in states:
-            body = state[k]
-            p = body['pos']
-            X.append(p[0])
-            Y.append(p[1])
-            Z.append(p[2])
-        ax.plot(X, Y, Z, color='blue', linewidth=lw)
+# One decimated path (vertices x 3) per body
+def render_trajectories(ax, paths):
+    for P in paths:
+        figureoutput.layer(ax.plot(P[:, 0], P[:, 1], P[:, 2], color='blue', linewidth=lw),
+                           'trajectories', output)
 
 def set_view(ax):
     ax.view_init(30, 30)
 
 outputpath = '../latex/images/nbody/'
 
+# How the trajectories are reduced before plotting, see trajstore.decimate
+decimation = trajstore.default_decimation.set('max-vertices', 2000);
+
 ### Main code
-last_state = states[len(states)-1]
+def last_state():
+    traj = load_traj();
+    return state_at(traj, len(traj['pos'])-1);
+
+@functools.lru_cache(maxsize=None)
+def decimated_paths():
+    with stages.span('decimate'):
+        return trajstore.decimate(trajstore.traj_blocks(load_traj()), decimation);
 
 def trajectory_plot():
     fig, ax = make_plot()
-    render_trajectories(ax, states)
-    render_planets(ax, last_state)
-    set_view(ax);
-    fig.savefig(outputpath + 'trajectories.pdf');
+    paths = decimated_paths();
+    state = last_state();
+    with stages.span('draw'):
+        render_trajectories(ax, paths)
+        render_planets(ax, state)
+        set_view(ax);
+    figureoutput.save(fig, outputpath + 'trajectories.pdf', output);
 
 def pair_plot():
     fig, ax = make_plot()
-    render_connections(ax, last_state)
-    render_planets(ax, last_state)
-    set_view(ax);
-    fig.savefig(outputpath + 'pairs.pdf');
+    state = last_state();
+    with stages.span('draw'):
+        render_connections(ax, state)
+        render_planets(ax, state)
+        set_view(ax);
+    figureoutput.save(fig, outputpath + 'pairs.pdf', output);
 
 def velocity_plot():
     fig, ax = make_plot()
-    render_trajectories(ax, states)
-    render_planets(ax, last_state)
-    render_velocities(ax, last_state, 2.0)
-    set_view(ax);
-    fig.savefig(outputpath + 'velocities.pdf');
-
-trajectory_plot()
-pair_plot()
-velocity_plot()
+    state = last_state();
+    paths = decimated_paths();
+    with stages.span('draw'):
+        render_trajectories(ax, paths)
+        render_planets(ax, state)
+        render_velocities(ax, state, 2.0)
+        set_view(ax);
+    figureoutput.save(fig, outputpath + 'velocities.pdf', output);
+
+settings = [fs, ms, lw, outputpath, decimation, connections, output];
+
+plotbuild.step('nbody-trajectories', trajectory_plot, [states_file], settings)
+plotbuild.step('nbody-pairs', pair_plot, [states_file], settings)
+plotbuild.step('nbody-velocities', velocity_plot, [states_file], settings)
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import hashlib
+import contextlib
+import collections.abc
+import matplotlib.figure
+import stages
+
+# Incremental building of the figures: Every step of a plot script is
+# identified by a name and a key, which is a hash of its input files,
+# its settings and the source code that renders it. A step is skipped
+# if its key is unchanged since it was last built and the files it
+# saved are still there.
+#
+# Every script passes its command line to 'init', and accepts the flags
+#   --dry-run   List the steps that are stale, without rendering anything
+#   --force     Rebuild every step
+#
+# The code of a step includes the script and every module of this
+# directory that it has imported, such as benjmark.py and figureoutput.py.
+
+manifest_filename = '.plotbuild.json';
+
+dry_run = False;
+force = False;
+
+def init(argv):
+    global dry_run, force;
+    dry_run = '--dry-run' in argv;
+    force = '--force' in argv;
+
+stages.install_savefig();
+
+def load_manifest():
+    try:
+        with open(manifest_filename) as f:
+            return json.load(f);
+    except (OSError, ValueError):
+        return {'steps': {}, 'hashes': {}};
+
+def save_manifest(manifest):
+    with open(manifest_filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True);
+    os.replace(manifest_filename + '.tmp', manifest_filename);
+
+# Content hash of a file, reused as long as its size and mtime are unchanged
+def file_hash(manifest, filename):
+    path = os.path.abspath(filename);
+    if not(os.path.exists(path)):
+        return None;
+    st = os.stat(path);
+    stamp = [st.st_size, st.st_mtime_ns];
+    known = manifest['hashes'].get(path);
+    if known != None and known['stamp'] == stamp:
+        return known['sha1'];
+    h = hashlib.sha1();
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block);
+    manifest['hashes'][path] = {'stamp': stamp, 'sha1': h.hexdigest()};
+    return h.hexdigest();
+
+# Settings are pmaps and psets, whose iteration order is not stable
+# between processes
+def canonical(value):
+    if hasattr(value, 'items'):
+        return {str(k): canonical(v) for k, v in value.items()};
+    if isinstance(value, (str, bytes)):
+        return value;
+    if isinstance(value, collections.abc.Set):
+        return sorted((canonical(v) for v in value), key=repr);
+    if hasattr(value, '__iter__'):
+        return [canonical(v) for v in value];
+    return value;
+
+def value_hash(value):
+    text = json.dumps(canonical(value), sort_keys=True, default=repr);
+    return hashlib.sha1(text.encode('utf-8')).hexdigest();
+
+def step_key(manifest, files, values, code):
+    h = hashlib.sha1();
+    for filename in sorted(set(files)):
+        h.update((filename + ':' + str(file_hash(manifest, filename)) + '\n').encode('utf-8'));
+    for filename in sorted(set(code)):
+        h.update(('code:' + str(file_hash(manifest, filename)) + '\n').encode('utf-8'));
+    h.update(value_hash(values).encode('utf-8'));
+    return h.hexdigest();
+
+# Record the names of all files saved through Figure.savefig
+@contextlib.contextmanager
+def recording_outputs():
+    outputs = [];
+    savefig = matplotlib.figure.Figure.savefig;
+    def recording_savefig(fig, fname, *args, **kwargs):
+        if isinstance(fname, (str, os.PathLike)):
+            outputs.append(os.path.abspath(fname));
+        return savefig(fig, fname, *args, **kwargs);
+    matplotlib.figure.Figure.savefig = recording_savefig;
+    try:
+        yield outputs;
+    finally:
+        matplotlib.figure.Figure.savefig = savefig;
+
+# The source files of the imported modules of this directory
+def module_files():
+    directory = os.path.dirname(os.path.abspath(__file__));
+    dst = [];
+    for m in list(sys.modules.values()):
+        filename = getattr(m, '__file__', None);
+        if filename != None and os.path.dirname(os.path.abspath(filename)) == directory:
+            dst.append(os.path.abspath(filename));
+    return dst;
+
+def is_up_to_date(entry, key):
+    if entry == None or entry['key'] != key:
+        return False;
+    for filename in entry['outputs']:
+        if not(os.path.exists(filename)):
+            return False;
+    return True;
+
+# Run 'render' unless the step is up to date. 'render' may return a list
+# of the files it wrote, in addition to those saved through Figure.savefig
+# (files saved by worker processes are only known that way).
+def step(name, render, files=[], values=None, code=[]):
+    manifest = load_manifest();
+    code = [os.path.abspath(f) for f in [sys.argv[0]] + list(code)] + module_files();
+    key = step_key(manifest, files, values, code);
+    entry = manifest['steps'].get(name);
+    if not(force) and is_up_to_date(entry, key):
+        save_manifest(manifest);
+        stages.count('up-to-date');
+        return False;
+    if dry_run:
+        print('stale: ' + name);
+        return True;
+    with recording_outputs() as outputs, stages.span(name):
+        written = render();
+    if isinstance(written, (list, tuple)):
+        outputs.extend(os.path.abspath(f) for f in written);
+    manifest['steps'][name] = {'key': key, 'outputs': sorted(set(outputs))};
+    save_manifest(manifest);
+    return True;
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Finding pairs of nearby points, for drawing the connections between
+# bodies. All functions return the pairs as two index arrays (I, J)
+# with I < J, every pair listed once.
+
+def unique_pairs(n):
+    return np.triu_indices(n, 1);
+
+# The offsets to the neighbouring grid cells, half of them, so that every
+# pair of cells is visited once.
+def forward_offsets(dim):
+    grid = np.stack(np.meshgrid(*[[-1, 0, 1]]*dim, indexing='ij'), axis=-1).reshape(-1, dim);
+    keep = [tuple(o) >= (0,)*dim for o in grid];
+    return grid[keep];
+
+def cell_keys(cells, lo, shape):
+    c = cells - lo;
+    return (c[:, 0]*shape[1] + c[:, 1])*shape[2] + c[:, 2];
+
+# All pairs closer than 'cutoff', using a uniform grid with cells of
+# size 'cutoff': Only points in the same or neighbouring cells are compared.
+def cutoff_pairs(P, cutoff):
+    P = np.asarray(P, dtype=np.float64);
+    n = len(P);
+    if n < 2:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64));
+    cells = np.floor(P/cutoff).astype(np.int64);
+    lo = cells.min(axis=0) - 1;
+    shape = cells.max(axis=0) - lo + 2;
+    keys = cell_keys(cells, lo, shape);
+    order = np.argsort(keys, kind='stable');
+    sorted_keys = keys[order];
+
+    I = [];
+    J = [];
+    for offset in forward_offsets(3):
+        neighbour = cell_keys(cells + offset, lo, shape);
+        begin = np.searchsorted(sorted_keys, neighbour, side='left');
+        end = np.searchsorted(sorted_keys, neighbour, side='right');
+        counts = end - begin;
+        i = np.repeat(np.arange(n), counts);
+        first = np.repeat(begin - np.cumsum(counts) + counts, counts);
+        j = order[first + np.arange(len(i))];
+        if not(offset.any()):
+            mask = i < j;
+            i = i[mask];
+            j = j[mask];
+        d = P[i] - P[j];
+        near = (d*d).sum(axis=1) <= cutoff*cutoff;
+        I.append(i[near]);
+        J.append(j[near]);
+    I = np.concatenate(I);
+    J = np.concatenate(J);
+    return (np.minimum(I, J), np.maximum(I, J));
+
+# The pairs between every point and its k nearest neighbours, from a
+# k-d tree if SciPy is available, otherwise from distances computed in
+# blocks of rows.
+def knn_pairs(P, k, block_rows=1024):
+    P = np.asarray(P, dtype=np.float64);
+    n = len(P);
+    k = min(k, n - 1);
+    if k < 1:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64));
+    try:
+        from scipy.spatial import cKDTree
+        _, nearest = cKDTree(P).query(P, k + 1);
+        nearest = nearest[:, 1:];
+    except ImportError:
+        nearest = np.empty((n, k), dtype=np.int64);
+        sq = (P*P).sum(axis=1);
+        for a in range(0, n, block_rows):
+            b = min(n, a + block_rows);
+            d = sq[a:b, None] + sq[None, :] - 2.0*(P[a:b] @ P.T);
+            d[np.arange(b - a), np.arange(a, b)] = np.inf;
+            nearest[a:b] = np.argpartition(d, k - 1, axis=1)[:, 0:k];
+    i = np.repeat(np.arange(n), k);
+    j = nearest.reshape(-1);
+    pairs = np.unique(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1), axis=0);
+    return (pairs[:, 0], pairs[:, 1]);
@@ -1,6 +1,10 @@
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+import sys
+import plotbuild
+
+plotbuild.init(sys.argv);
 
 # https://matplotlib.org/users/usetex.html
 
@@ -19,8 +23,11 @@ matplotlib.rc('font', **font)
 #plt.rc('font', family='serif')
 
 
-plt.plot(X, Y, 'r');
-plt.xlabel('x');
-plt.ylabel(r'$x^2$');
-plt.savefig('../latex/images/square.pdf');
-plt.show();
+def render():
+    plt.plot(X, Y, 'r');
+    plt.xlabel('x');
+    plt.ylabel(r'$x^2$');
+    plt.savefig('../latex/images/square.pdf');
+    plt.show();
+
+plotbuild.step('square', render, [], [lw, fs]);
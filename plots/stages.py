@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import contextlib
+
+# Timing of the stages of the plot scripts: loading, grouping, drawing and
+# saving. Disabled unless the environment variable PLOT_STAGES is set:
+#
+#   PLOT_STAGES=1 python3 benchmark_nbody.py            Report on stderr
+#   PLOT_STAGES=stages.json python3 benchmark_nbody.py  Report as JSON
+#
+# Stages nest, and stages with the same name under the same parent are
+# added up. Every stage also has counters, such as the number of figures,
+# artists and bytes saved. When disabled, 'stage' returns the function
+# undecorated and 'span' a shared empty context.
+
+setting = os.environ.get('PLOT_STAGES', '');
+enabled = setting != '';
+
+def make_node(name):
+    return {'name': name, 'calls': 0, 'seconds': 0.0, 'counters': {}, 'children': {}};
+
+root = make_node('total');
+stack = [root];
+no_span = contextlib.nullcontext();
+
+def child_node(name):
+    children = stack[-1]['children'];
+    if not(name in children):
+        children[name] = make_node(name);
+    return children[name];
+
+@contextlib.contextmanager
+def timed_span(name):
+    node = child_node(name);
+    stack.append(node);
+    start = time.perf_counter();
+    try:
+        yield node;
+    finally:
+        node['seconds'] += time.perf_counter() - start;
+        node['calls'] += 1;
+        stack.pop();
+
+def span(name):
+    if enabled:
+        return timed_span(name);
+    return no_span;
+
+# Decorator timing every call of a function as a stage
+def stage(name):
+    def decorate(f):
+        if not(enabled):
+            return f;
+        @functools.wraps(f)
+        def timed(*args, **kwargs):
+            with timed_span(name):
+                return f(*args, **kwargs);
+        return timed;
+    return decorate;
+
+# Add n to a counter of the current stage
+def count(name, n=1):
+    if enabled:
+        counters = stack[-1]['counters'];
+        counters[name] = counters.get(name, 0) + n;
+
+# Run f with stages of its own, returning its result and the tree of the
+# stages it ran, for worker processes to send back to be merged
+def collect(f, *args):
+    global root, stack;
+    if not(enabled):
+        return (f(*args), None);
+    saved = (root, stack);
+    root = make_node('total');
+    stack = [root];
+    try:
+        result = f(*args);
+        return (result, tree(root));
+    finally:
+        root, stack = saved;
+
+# Add a collected tree under the current stage. The seconds of workers
+# that ran in parallel add up to more than the time that passed.
+def merge(collected, node=None):
+    if not(enabled) or collected == None:
+        return;
+    node = stack[-1] if node == None else node;
+    for k, v in collected['counters'].items():
+        node['counters'][k] = node['counters'].get(k, 0) + v;
+    for c in collected['children']:
+        if not(c['name'] in node['children']):
+            node['children'][c['name']] = make_node(c['name']);
+        child = node['children'][c['name']];
+        child['calls'] += c['calls'];
+        child['seconds'] += c['seconds'];
+        merge(c, child);
+
+def tree(node):
+    return {'name': node['name'],
+            'calls': node['calls'],
+            'seconds': node['seconds'],
+            'counters': dict(node['counters']),
+            'children': [tree(c) for c in node['children'].values()]};
+
+def report_lines(node, depth):
+    counters = ', '.join('{:s}={:d}'.format(k, v) for k, v in sorted(node['counters'].items()));
+    lines = ['{:40s} {:6d} {:10.4f}  {:s}'.format('  '*depth + node['name'], node['calls'],
+                                                  node['seconds'], counters)];
+    for c in node['children'].values():
+        lines += report_lines(c, depth + 1);
+    return lines;
+
+def report():
+    root['seconds'] = time.perf_counter() - started;
+    root['calls'] = 1;
+    if setting.endswith('.json'):
+        with open(setting, 'w') as f:
+            json.dump(tree(root), f, indent=2);
+    else:
+        header = '{:40s} {:>6s} {:>10s}  {:s}'.format('stage', 'calls', 'seconds', 'counters');
+        sys.stderr.write('\n'.join([header] + report_lines(root, 0)) + '\n');
+
+# Every saved figure is a 'save' stage, counting the figures, their
+# artists and the bytes written. Called once Matplotlib is imported.
+savefig_installed = False;
+
+def install_savefig():
+    global savefig_installed;
+    if not(enabled) or savefig_installed:
+        return;
+    savefig_installed = True;
+    import matplotlib.figure
+    savefig = matplotlib.figure.Figure.savefig;
+    def timed_savefig(fig, fname, *args, **kwargs):
+        with timed_span('save'):
+            count('figures');
+            count('artists', len(fig.findobj()));
+            result = savefig(fig, fname, *args, **kwargs);
+            if isinstance(fname, (str, os.PathLike)) and os.path.exists(fname):
+                count('bytes', os.path.getsize(fname));
+            return result;
+    matplotlib.figure.Figure.savefig = timed_savefig;
+
+if enabled:
+    started = time.perf_counter();
+    atexit.register(report);
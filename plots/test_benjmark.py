@@ -0,0 +1,65 @@
+import numpy as np
+import benjmark
+
+# Candidate 'ref' has a zero time, as the C++ harness reports for runs
+# below its resolution, so some bootstrap medians of it are zero.
+def zero_reference_table():
+    return benjmark.make_table(np.array([0, 0, 0, 0], dtype=np.int64),
+                               np.array([0, 0, 1, 1], dtype=np.int32),
+                               np.array([0.0, 1.0e-6, 2.0e-6, 3.0e-6]),
+                               ['ref', 'cand'],
+                               np.array([1000], dtype=np.int64));
+
+def test_zero_reference_sample():
+    settings = benjmark.default_settings.set('bootstrap', 200);
+    stats = benjmark.sample_statistics(zero_reference_table(), settings);
+    assert (stats['bootstrap'][0] == 0.0).any();
+    low, high = benjmark.ratio_interval(stats, 1, 0, settings);
+    assert np.isfinite(low) and np.isfinite(high);
+    ppm = benjmark.make_per_problem_map(stats);
+    problem = {'index': 0, 'size': 1000};
+    candidates = {'ref': {'name': 'Ref'}, 'cand': {'name': 'Cand'}};
+    spec = benjmark.make_barplot_spec(problem, ppm[0], stats, candidates, ['ref', 'cand'], settings);
+    assert len(spec['texts']) == 2;
+
+def test_format_non_finite():
+    assert benjmark.basic_format(float('nan')) == '?';
+    assert benjmark.interval_format(float('inf'), 1.5) == '[?, 1.5]';
+
+# Problem 1 only has results of a candidate that is not plotted
+def test_barplots_without_results_for_keys(tmp_path):
+    import json
+    root = str(tmp_path);
+    for name, data in [('probleminfo.json', {'count': 2}),
+                       ('problem0000.json', {'size': 10, 'data': []}),
+                       ('problem0001.json', {'size': 20, 'data': []}),
+                       ('candidates.json', {'a': {'name': 'A'}, 'b': {'name': 'B'}}),
+                       ('results.json', [{'problem-index': 0, 'cand-key': 'a', 'time-seconds': 1.0},
+                                         {'problem-index': 1, 'cand-key': 'b', 'time-seconds': 2.0}])]:
+        with open(root + '/' + name, 'w') as f:
+            json.dump(data, f);
+    settings = benjmark.default_settings.set('outputprefix', root + '/');
+    filenames = benjmark.render_barplots(['a'], root, settings);
+    assert filenames == [root + '/bars0000.pdf'];
+    stats = benjmark.sample_statistics(benjmark.load_results(root), settings);
+    ppm = benjmark.make_per_problem_map(stats);
+    assert benjmark.make_barplot_spec({'index': 1, 'size': 20}, ppm[1], stats,
+                                      {'a': {'name': 'A'}}, ['a'], settings) == None;
+
+# A series of a single point has no fit, and must not write NaN
+def test_fit_report_without_degenerate_fits():
+    import json
+    fits = benjmark.fit_scaling_laws([(np.array([10.0, 100.0]), np.array([1.0, 10.0])),
+                                      (np.array([10.0]), np.array([2.0]))], 'power', False);
+    report = benjmark.fit_report(['a', 'b'], fits, benjmark.crossovers(fits), (10.0, 100.0));
+    assert list(report['fits'].keys()) == ['a'];
+    json.dumps(report, allow_nan=False);
+
+# The timings within one process count as a single sample
+def test_results_table_with_time_samples():
+    results = [{'problem-index': 0, 'cand-key': 'a', 'time-seconds': 2.0, 'time-samples': [1.0, 2.0, 4.0]},
+               {'problem-index': 0, 'cand-key': 'a', 'time-seconds': 3.0}];
+    table = benjmark.make_results_table(results, [{'index': 0, 'size': 10}]);
+    assert table['time-seconds'].tolist() == [2.0, 3.0];
+    stats = benjmark.sample_statistics(table, benjmark.default_settings.set('bootstrap', 0));
+    assert stats['count'].tolist() == [2];
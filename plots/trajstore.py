@@ -0,0 +1,308 @@
+import json
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import pyrsistent as pyr
+
+# Compact storage of an n-body state sequence (stateseq.json), as written
+# by nbody.main/save-state-seq: A list of states, each one mapping a body
+# name to its 'pos', 'vel' and 'mass'.
+#
+# The binary file is laid out as
+#
+#   magic (8 bytes) | header length (uint64) | JSON header | padding | arrays
+#
+# where the arrays are little-endian float64, 64-byte aligned, and can be
+# memory mapped:
+#
+#   pos   states x bodies x 3
+#   vel   states x bodies x 3
+#   mass  bodies
+
+magic = b'NBTRAJ1\n';
+alignment = 64;
+
+def aligned(n):
+    return (n + alignment - 1)//alignment*alignment;
+
+separators = re.compile(r'[\s,\[]*');
+
+# Iterate over the states of a JSON state sequence, one at a time, without
+# reading the whole document. Only the current state and one block of the
+# file are held in memory.
+def iterate_states(json_file, block_size=1 << 16):
+    decoder = json.JSONDecoder();
+    with open(json_file) as f:
+        buf = f.read(block_size);
+        pos = 0;
+        eof = len(buf) == 0;
+        while True:
+            pos = separators.match(buf, pos).end();
+            if pos < len(buf) and buf[pos] == ']':
+                return;
+            try:
+                if pos == len(buf):
+                    raise json.JSONDecodeError('More data needed', buf, pos);
+                state, pos = decoder.raw_decode(buf, pos);
+            except json.JSONDecodeError:
+                if eof:
+                    if pos == len(buf):
+                        return;
+                    raise;
+                block = f.read(block_size);
+                eof = len(block) == 0;
+                buf = buf[pos:] + block;
+                pos = 0;
+                continue;
+            yield state;
+
+def state_vectors(state, names, key):
+    return np.array([state[k][key] for k in names], dtype='<f8');
+
+# Group the positions and velocities of consecutive states into blocks
+# of shape (states x bodies x 3)
+def state_blocks(states, names, block_states=4096):
+    pos = [];
+    vel = [];
+    for state in states:
+        pos.append(state_vectors(state, names, 'pos'));
+        vel.append(state_vectors(state, names, 'vel'));
+        if len(pos) == block_states:
+            yield (np.array(pos), np.array(vel));
+            pos = [];
+            vel = [];
+    if 0 < len(pos):
+        yield (np.array(pos), np.array(vel));
+
+def layout(names, state_count):
+    body_count = len(names);
+    shapes = [('pos', [state_count, body_count, 3]),
+              ('vel', [state_count, body_count, 3]),
+              ('mass', [body_count])];
+    header = {'names': names, 'dtype': '<f8', 'arrays': {}};
+    offset = 0;
+    for key, shape in shapes:
+        header['arrays'][key] = {'shape': shape, 'offset': offset};
+        offset = aligned(offset + 8*int(np.prod(shape)));
+    return header;
+
+def encode_header(header):
+    text = json.dumps(header).encode('utf-8');
+    start = aligned(len(magic) + 8 + len(text));
+    return (text, start);
+
+def write_padding(f, start):
+    f.write(b'\0'*(start - f.tell()));
+
+# Convert in a single pass and in constant memory: The positions and
+# velocities are first written to temporary files, because their sizes are
+# only known at the end.
+def convert(json_file, traj_file):
+    states = iterate_states(json_file);
+    first = next(states, None);
+    if first == None:
+        raise ValueError('No states in ' + json_file);
+    names = list(first.keys());
+    mass = np.array([first[k].get('mass', 0.0) for k in names], dtype='<f8');
+    state_count = 0;
+    with tempfile.TemporaryFile() as pos_file, tempfile.TemporaryFile() as vel_file:
+        for pos, vel in state_blocks(iterate_chain(first, states), names):
+            pos_file.write(pos.astype('<f8').tobytes());
+            vel_file.write(vel.astype('<f8').tobytes());
+            state_count += len(pos);
+
+        header = layout(names, state_count);
+        text, start = encode_header(header);
+        tmp = traj_file + '.tmp';
+        with open(tmp, 'wb') as f:
+            f.write(magic);
+            f.write(np.uint64(len(text)).tobytes());
+            f.write(text);
+            for key, src in [('pos', pos_file), ('vel', vel_file)]:
+                write_padding(f, start + header['arrays'][key]['offset']);
+                src.seek(0);
+                shutil.copyfileobj(src, f);
+            write_padding(f, start + header['arrays']['mass']['offset']);
+            f.write(mass.tobytes());
+        os.replace(tmp, traj_file);
+
+def iterate_chain(first, rest):
+    yield first;
+    yield from rest;
+
+# A map with the body 'names' and the arrays 'pos', 'vel' and 'mass',
+# memory mapped read-only from the file.
+def load(traj_file):
+    with open(traj_file, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('Not a trajectory file: ' + traj_file);
+        n = int(np.frombuffer(f.read(8), dtype='<u8')[0]);
+        header = json.loads(f.read(n).decode('utf-8'));
+    start = aligned(len(magic) + 8 + n);
+    dst = {'names': header['names']};
+    for key, a in header['arrays'].items():
+        shape = tuple(a['shape']);
+        if np.prod(shape) == 0:
+            dst[key] = np.zeros(shape);
+        else:
+            dst[key] = np.memmap(traj_file, dtype=header['dtype'], mode='r',
+                                 offset=start + a['offset'], shape=shape);
+    return dst;
+
+def traj_filename(json_file):
+    return os.path.splitext(json_file)[0] + '.traj';
+
+# Load the trajectory file next to the JSON file, converting it first if
+# it is missing or older than the JSON file.
+def load_or_convert(json_file):
+    traj_file = traj_filename(json_file);
+    if not(os.path.exists(traj_file)) or os.path.getmtime(traj_file) < os.path.getmtime(json_file):
+        convert(json_file, traj_file);
+    return load(traj_file);
+
+###################################### Decimation
+
+# Reduce every body trajectory to at most 'max-vertices' vertices, reading
+# the positions block by block. With mode 'stride', every 'stride'th state
+# is kept. With mode 'error', a vertex is only kept when the trajectory
+# deviates more than 'tolerance' from the straight segment since the last
+# kept vertex ('window' bounds how many states such a segment may span).
+# Whenever a trajectory exceeds 'max-vertices', every other vertex is
+# dropped, so memory is bounded no matter how long the sequence is.
+default_decimation = pyr.pmap({
+    'mode': 'stride',
+    'stride': 1,
+    'tolerance': 0.01,
+    'window': 64,
+    'max-vertices': 2000
+});
+
+# Drop every other vertex, but keep the last one, which is the anchor of
+# the next segment
+def thin(kept, settings):
+    if settings['max-vertices'] < len(kept):
+        return kept[0::2] + ([kept[-1]] if len(kept) % 2 == 0 else []);
+    return kept;
+
+# Distance from the points P (window x bodies x 3) to the segments from
+# A to B (bodies x 3)
+def segment_distances(P, A, B):
+    d = B - A;
+    dd = np.maximum((d*d).sum(axis=-1), 1.0e-300);
+    t = np.clip(((P - A)*d).sum(axis=-1)/dd, 0.0, 1.0);
+    closest = A + t[..., None]*d;
+    return np.sqrt(((P - closest)**2).sum(axis=-1));
+
+def decimate_stride(blocks, settings):
+    stride = settings['stride'];
+    kept = None;
+    offset = 0;
+    last = None;
+    for pos in blocks:
+        selected = pos[(-offset) % stride::stride];
+        kept = selected.copy() if kept is None else np.concatenate([kept, selected]);
+        offset += len(pos);
+        last = pos[-1].copy();
+        while settings['max-vertices'] < len(kept):
+            kept = kept[0::2].copy();
+            stride *= 2;
+    if kept is None:
+        return [];
+    if (offset - 1) % stride != 0:
+        kept = np.concatenate([kept, last[None]]);
+    return [kept[:, k, :] for k in range(0, kept.shape[1])];
+
+# The states since the oldest anchor are kept in 'window', and 'start'
+# holds, per body, the first row of the window after its anchor.
+def decimate_error(blocks, settings):
+    tol = settings['tolerance'];
+    width = settings['window'];
+    kept = None;
+    for pos in blocks:
+        for p in pos:
+            if kept is None:
+                kept = [[q.copy()] for q in p];
+                window = p[None].copy();
+                start = np.ones(len(p), dtype=np.int64);
+                continue;
+            anchor = np.array([k[-1] for k in kept]);
+            rows = np.arange(len(window))[:, None];
+            dist = np.where(start[None, :] <= rows,
+                            segment_distances(window, anchor, p), 0.0).max(axis=0);
+            split = (tol < dist) | (width <= len(window) - start);
+            for k in np.flatnonzero(split):
+                kept[k].append(window[-1, k].copy());
+                kept[k] = thin(kept[k], settings);
+            window = np.concatenate([window, p[None]]);
+            start[split] = len(window) - 1;
+            drop = start.min() - 1;
+            if 0 < drop:
+                window = window[drop:];
+                start -= drop;
+    if kept is None:
+        return [];
+    dst = [];
+    for k in range(0, len(kept)):
+        path = kept[k];
+        if not(np.array_equal(path[-1], window[-1, k])):
+            path = path + [window[-1, k]];
+        dst.append(np.array(path));
+    return dst;
+
+def decimate(blocks, settings=default_decimation):
+    if settings['mode'] == 'stride':
+        return decimate_stride(blocks, settings);
+    elif settings['mode'] == 'error':
+        return decimate_error(blocks, settings);
+    raise ValueError('Unknown decimation mode: ' + str(settings['mode']));
+
+# The blocks of positions from a memory mapped trajectory
+def traj_blocks(traj, block_states=4096):
+    pos = traj['pos'];
+    for i in range(0, len(pos), block_states):
+        yield np.asarray(pos[i:i + block_states]);
+
+
+
+# Compare the time and peak memory of reading all positions through the
+# JSON path and through the memory mapped file.
+def benchmark(json_file):
+    import tracemalloc
+    traj_file = traj_filename(json_file);
+    convert(json_file, traj_file);
+
+    # Timed without tracemalloc, which slows down allocations
+    def measure(label, f):
+        start = time.perf_counter();
+        checksum = f();
+        elapsed = time.perf_counter() - start;
+        tracemalloc.start();
+        f();
+        peak = tracemalloc.get_traced_memory()[1];
+        tracemalloc.stop();
+        print('{:>6s}: {:8.4f} s, peak {:10.1f} KiB (checksum {:.6g})'.format(
+            label, elapsed, peak/1024.0, checksum));
+
+    def from_json():
+        with open(json_file) as f:
+            states = json.load(f);
+        return sum(p for state in states for k in state for p in state[k]['pos']);
+
+    def from_traj():
+        return float(load(traj_file)['pos'].sum());
+
+    measure('json', from_json);
+    measure('traj', from_traj);
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python3 trajstore.py stateseq.json [--benchmark]');
+        sys.exit(1);
+    if '--benchmark' in sys.argv:
+        benchmark(sys.argv[1]);
+    else:
+        convert(sys.argv[1], traj_filename(sys.argv[1]));
@@ -0,0 +1,159 @@
+import gc
+import os
+import json
+import time
+import struct
+import statistics
+import numpy as np
+
+# The Python counterpart of cpp/benjmark.h: A candidate is a 'setup' with
+# three functions,
+#
+#   input:   the 'data' of the problem JSON -> problem
+#   compute: problem -> output
+#   output:  output -> JSON
+#
+# and perform runs it on a problem file, writing the same result JSON as
+# bj::perform: 'time-seconds', 'output' and 'dry-output'.
+#
+# Unlike bj::perform, compute is first run until its times stabilise, and
+# short computations are repeated until they have run for at least
+# 'min-seconds'. The repetitions run with the garbage collector disabled,
+# and 'time-seconds' is their median. The result JSON also holds every
+# repetition in 'time-samples'.
+#
+# If the problem file has a binary companion, problemNNNN.bin, that is at
+# least as new, it is read instead, and its large arrays are NumPy arrays
+# mapped from the file. See plots/benjbin.py for the format.
+
+default_settings = {
+    # Warm-up ends once two consecutive times differ by less than this
+    # fraction, or after 'max-warmup-runs' runs or 'max-warmup-seconds'.
+    'warmup-tolerance': 0.05,
+    'max-warmup-runs': 10,
+    'max-warmup-seconds': 5.0,
+
+    # Repetitions of the timed run
+    'min-seconds': 0.2,
+    'min-repetitions': 1,
+    'max-repetitions': 1000
+};
+
+def read_json(filename):
+    with open(filename) as f:
+        return json.load(f);
+
+###################################### Binary problem files
+
+# Copies of magic, binary_filename, read_header, join_arrays, load_problem
+# and is_current of plots/benjbin.py, which specifies the format of the
+# binary problem files. The candidates do not depend on the plot scripts,
+# so the two copies must be changed together.
+
+magic = b'BJPROB01';
+
+def binary_filename(json_filename):
+    return os.path.splitext(json_filename)[0] + '.bin';
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('Not a binary problem file: ' + filename);
+        (n,) = struct.unpack('<Q', f.read(8));
+        return json.loads(f.read(n).decode('utf-8'));
+
+def join_arrays(value, arrays):
+    if isinstance(value, dict):
+        if 'bj-array' in value:
+            return arrays[value['bj-array']];
+        return {k: join_arrays(v, arrays) for k, v in value.items()};
+    if isinstance(value, list):
+        return [join_arrays(v, arrays) for v in value];
+    return value;
+
+# The problem, with its arrays as read-only NumPy arrays mapped from the file
+def load_problem(filename):
+    header = read_header(filename);
+    arrays = [np.memmap(filename, dtype='<f8', mode='r', offset=a['offset'], shape=tuple(a['shape']))
+              for a in header.pop('arrays')];
+    return join_arrays(header, arrays);
+
+def is_current(json_filename):
+    filename = binary_filename(json_filename);
+    # In nanoseconds, as isCurrent in cpp/benjmark.cpp, so that all loaders
+    # agree when the two files are written within the same second
+    return (os.path.exists(filename) and
+            os.stat(json_filename).st_mtime_ns <= os.stat(filename).st_mtime_ns);
+
+# The problem file, or its binary companion if there is a current one
+def read_problem(filename):
+    if is_current(filename):
+        return load_problem(binary_filename(filename));
+    return read_json(filename);
+
+def write_json(filename, data):
+    with open(filename, 'w') as f:
+        json.dump(data, f);
+
+def timed_call(compute, problem):
+    start = time.perf_counter_ns();
+    output = compute(problem);
+    return (output, time.perf_counter_ns() - start);
+
+def is_stable(a, b, tolerance):
+    return abs(a - b) <= tolerance*max(a, b);
+
+# Returns the output of the first run and the time of the last run, in ns
+def warm_up(compute, problem, settings):
+    dry_output, last = timed_call(compute, problem);
+    total = last;
+    for i in range(1, settings['max-warmup-runs']):
+        if settings['max-warmup-seconds']*1.0e9 <= total:
+            break;
+        _, t = timed_call(compute, problem);
+        total += t;
+        stable = is_stable(last, t, settings['warmup-tolerance']);
+        last = t;
+        if stable:
+            break;
+    return (dry_output, last);
+
+def repetition_count(expected_ns, settings):
+    n = int(settings['min-seconds']*1.0e9/max(1, expected_ns)) + 1;
+    return max(settings['min-repetitions'], min(settings['max-repetitions'], n));
+
+# The times of 'count' runs, in seconds, with the garbage collector disabled
+def timed_runs(compute, problem, count):
+    times = [];
+    gc.collect();
+    enabled = gc.isenabled();
+    gc.disable();
+    try:
+        for i in range(0, count):
+            output, t = timed_call(compute, problem);
+            times.append(t*1.0e-9);
+    finally:
+        if enabled:
+            gc.enable();
+    return (output, times);
+
+def perform(setup, input_filename, output_filename, settings=default_settings):
+    print("Load json");
+    input_json = read_problem(input_filename);
+    print("Import data");
+    problem = setup['input'](input_json['data']);
+    print("Dry run");
+    dry_output, expected = warm_up(setup['compute'], problem, settings);
+    print("Run");
+    output, times = timed_runs(setup['compute'], problem, repetition_count(expected, settings));
+    print("Export data");
+
+    results = {
+        'time-seconds': statistics.median(times),
+        'time-samples': times,
+        'output': setup['output'](output),
+        'dry-output': setup['output'](dry_output)
+    };
+    print("Save data");
+    write_json(output_filename, results);
+    print("Done");
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import sys
+import json
+import math
+import numpy as np
+import bj
+
+# The circle fitting benchmark in NumPy, computing the same thing as
+# cpp/circleopt.cpp and cljd.circle: Gradient descent on the mean squared
+# distance from the points to the circle,
+#
+#   f(cx, cy, r) = mean((|p - c| - r)^2)
+#
+# The cost and its gradient are evaluated for many parameter sets at once,
+# each parameter set being a row (cx, cy, r) of an array.
+#
+# Usage:
+#   circleopt.py problem.json output.json     As a benchmark candidate
+#   circleopt.py --samples samples.json [--seed S]
+
+# default-settings in cljd.circle, and the 'sample-count' and 'opt-count'
+# that produce-sample-circles-and-points uses instead of the :opt-count 10
+# of default-settings
+default_settings = {
+    'ranges': {'cx': [-1.0, 1.0], 'cy': [-1.0, 1.0], 'r': [0.5, 2.0]},
+    'noise': 0.1,
+    'count': 30,
+    'step-size': 0.25,
+    'iterations': 30,
+    'sample-count': 100,
+    'opt-count': 20
+};
+
+param_keys = ['cx', 'cy', 'r'];
+
+# Parameter sets are evaluated in blocks, so that the temporary arrays of
+# (parameter sets x points) have at most this many elements.
+block_elements = 1 << 20;
+
+def params_array(params):
+    return np.array([[p[k] for k in param_keys] for p in params], dtype=np.float64).reshape(-1, 3);
+
+def params_map(row):
+    return {k: float(x) for k, x in zip(param_keys, row)};
+
+def points_array(points):
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2);
+
+def block_cost_and_gradient(P, points):
+    dx = points[None, :, 0] - P[:, 0:1];
+    dy = points[None, :, 1] - P[:, 1:2];
+    dist = np.sqrt(dx*dx + dy*dy);
+    e = dist - P[:, 2:3];
+    k = -2.0*e/dist;
+    cost = (e*e).mean(axis=1);
+    gradient = np.stack([(k*dx).mean(axis=1),
+                         (k*dy).mean(axis=1),
+                         -2.0*e.mean(axis=1)], axis=1);
+    return (cost, gradient);
+
+# The costs (K) and gradients (K x 3) of the parameter sets P (K x 3)
+def cost_and_gradient(P, points):
+    P = np.asarray(P, dtype=np.float64).reshape(-1, 3);
+    rows = max(1, block_elements//max(1, len(points)));
+    if len(P) <= rows:
+        return block_cost_and_gradient(P, points);
+    cost = np.empty(len(P));
+    gradient = np.empty((len(P), 3));
+    for a in range(0, len(P), rows):
+        b = min(len(P), a + rows);
+        cost[a:b], gradient[a:b] = block_cost_and_gradient(P[a:b], points);
+    return (cost, gradient);
+
+def optimize(P, points, iterations, step_size):
+    P = np.array(P, dtype=np.float64).reshape(-1, 3);
+    for i in range(0, iterations):
+        P -= step_size*cost_and_gradient(P, points)[1];
+    return P;
+
+# Every parameter set along the descent, like opt-seq in cljd.circle:
+# An array of shape (iterations x K x 3), starting with P.
+def optimization_sequence(P, points, iterations, step_size):
+    P = np.array(P, dtype=np.float64).reshape(-1, 3);
+    dst = np.empty((iterations,) + P.shape);
+    for i in range(0, iterations):
+        dst[i] = P;
+        P = P - step_size*cost_and_gradient(P, points)[1];
+    return dst;
+
+setup = {
+    'input': lambda src: {'iterations': int(src['settings']['iterations']),
+                          'step-size': float(src['settings']['step-size']),
+                          'params': params_array([src['init-params']]),
+                          'points': points_array(src['points'])},
+    'compute': lambda problem: optimize(problem['params'], problem['points'],
+                                        problem['iterations'], problem['step-size']),
+    'output': lambda P: params_map(P[0])
+};
+
+###################################### Samples for circle.py
+
+def sample_parameters(rng, settings, n):
+    ranges = settings['ranges'];
+    return np.stack([rng.uniform(ranges[k][0], ranges[k][1], n) for k in param_keys], axis=1);
+
+def generate_points(rng, params, settings):
+    n = settings['count'];
+    noise = settings['noise'];
+    angle = rng.uniform(0.0, 2.0*math.pi, n);
+    cx, cy, r = params;
+    return np.stack([cx + r*np.cos(angle) + rng.uniform(-noise, noise, n),
+                     cy + r*np.sin(angle) + rng.uniform(-noise, noise, n)], axis=1);
+
+# The parameter sets P as maps with their 'cost' and 'gradient'
+def decorate(P, points):
+    cost, gradient = cost_and_gradient(P, points);
+    return [dict(params_map(p), cost=float(c), gradient=params_map(g))
+            for p, c, g in zip(P, cost, gradient)];
+
+# The data of produce-sample-circles-and-points in cljd.circle
+def produce_samples(settings=default_settings, seed=None):
+    rng = np.random.default_rng(seed);
+    params = sample_parameters(rng, settings, 1);
+    points = generate_points(rng, params[0], settings);
+    iterations = settings['iterations'];
+    step_size = settings['step-size'];
+    opt_params = optimize(params, points, iterations, step_size);
+    samples = sample_parameters(rng, settings, settings['sample-count']);
+    opt_init = sample_parameters(rng, settings, settings['opt-count']);
+    opt_seq = optimization_sequence(opt_init, points, iterations, step_size);
+    opt_steps = [decorate(P, points) for P in opt_seq];
+    return {'params': decorate(params, points)[0],
+            'opt_params': decorate(opt_params, points)[0],
+            'samples': decorate(samples, points),
+            'opt_samples': [[step[k] for step in opt_steps] for k in range(0, len(opt_init))],
+            'points': points.tolist()};
+
+def option(args, name, default):
+    if name in args:
+        return type(default)(args[args.index(name) + 1]);
+    return default;
+
+if __name__ == '__main__':
+    args = sys.argv[1:];
+    if '--samples' in args:
+        seed = option(args, '--seed', -1);
+        bj.write_json(option(args, '--samples', ''),
+                      produce_samples(default_settings, None if seed < 0 else seed));
+    elif len(args) == 2:
+        bj.perform(setup, args[0], args[1]);
+    else:
+        print('Usage: circleopt.py problem.json output.json');
+        sys.exit(1);
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import sys
+import json
+import numpy as np
+import bj
+
+# The n-body benchmark in NumPy, computing the same thing as
+# cpp/nbody.gpp-3main.cpp and srcjava/NBodySystem.java, with all pairwise
+# interactions of a step computed at once by broadcasting.
+#
+# Usage:
+#   nbody.py problem.json output.json        As a benchmark candidate
+#   nbody.py --check                         Compare with the reference energies
+#   nbody.py --stateseq stateseq.json [--bodies N] [--step-size DT] [--every K] [--count N]
+
+pi = 3.141592653589793;
+solar_mass = 4*pi*pi;
+days_per_year = 365.24;
+
+# Above this number of bodies, the interactions are computed in blocks of
+# rows, to bound the size of the temporary (block x bodies x 3) arrays.
+block_rows = 256;
+
+def solar_system():
+    names = ['sun', 'jupiter', 'saturn', 'uranus', 'neptune'];
+    pos = np.array([
+        [0.0, 0.0, 0.0],
+        [4.84143144246472090e+00, -1.16032004402742839e+00, -1.03622044471123109e-01],
+        [8.34336671824457987e+00, 4.12479856412430479e+00, -4.03523417114321381e-01],
+        [1.28943695621391310e+01, -1.51111514016986312e+01, -2.23307578892655734e-01],
+        [1.53796971148509165e+01, -2.59193146099879641e+01, 1.79258772950371181e-01]]);
+    vel = days_per_year*np.array([
+        [0.0, 0.0, 0.0],
+        [1.66007664274403694e-03, 7.69901118419740425e-03, -6.90460016972063023e-05],
+        [-2.76742510726862411e-03, 4.99852801234917238e-03, 2.30417297573763929e-05],
+        [2.96460137564761618e-03, 2.37847173959480950e-03, -2.96589568540237556e-05],
+        [2.68067772490389322e-03, 1.62824170038242295e-03, -9.51592254519715870e-05]]);
+    mass = solar_mass*np.array([
+        1.0,
+        9.54791938424326609e-04,
+        2.85885980666130812e-04,
+        4.36624404335156298e-05,
+        5.15138902046611451e-05]);
+    return offset_momentum({'names': names, 'pos': pos, 'vel': vel, 'mass': mass});
+
+# A sun with n - 1 light bodies on roughly circular orbits around it
+def random_system(n, seed=0):
+    rng = np.random.default_rng(seed);
+    radius = rng.uniform(1.0, 30.0, n);
+    angle = rng.uniform(0.0, 2*pi, n);
+    speed = np.sqrt(solar_mass/radius);
+    pos = np.stack([radius*np.cos(angle), radius*np.sin(angle), rng.normal(0.0, 0.1, n)], axis=1);
+    vel = np.stack([-speed*np.sin(angle), speed*np.cos(angle), np.zeros(n)], axis=1);
+    mass = rng.uniform(1.0e-6, 1.0e-4, n)*solar_mass;
+    pos[0] = 0.0;
+    vel[0] = 0.0;
+    mass[0] = solar_mass;
+    names = ['sun'] + ['body{:d}'.format(i) for i in range(1, n)];
+    return offset_momentum({'names': names, 'pos': pos, 'vel': vel, 'mass': mass});
+
+def offset_momentum(system):
+    p = (system['vel']*system['mass'][:, None]).sum(axis=0);
+    system['vel'][0] = -p/solar_mass;
+    return system;
+
+# The change in velocity of the bodies in rows a:b
+def velocity_change(pos, mass, dt, a, b):
+    d = pos[a:b, None, :] - pos[None, :, :];
+    d2 = (d*d).sum(axis=2);
+    d2[np.arange(b - a), np.arange(a, b)] = np.inf;
+    mag = dt/(d2*np.sqrt(d2));
+    return -(d*(mass[None, :]*mag)[:, :, None]).sum(axis=1);
+
+def advance(system, dt):
+    pos = system['pos'];
+    n = len(pos);
+    if n <= block_rows:
+        system['vel'] += velocity_change(pos, system['mass'], dt, 0, n);
+    else:
+        dv = np.empty_like(pos);
+        for a in range(0, n, block_rows):
+            b = min(n, a + block_rows);
+            dv[a:b] = velocity_change(pos, system['mass'], dt, a, b);
+        system['vel'] += dv;
+    pos += dt*system['vel'];
+
+def energy(system):
+    pos = system['pos'];
+    mass = system['mass'];
+    vel = system['vel'];
+    e = 0.5*(mass*(vel*vel).sum(axis=1)).sum();
+    i, j = np.triu_indices(len(pos), 1);
+    d = pos[i] - pos[j];
+    return e - (mass[i]*mass[j]/np.sqrt((d*d).sum(axis=1))).sum();
+
+def run(iterations, step_size):
+    system = solar_system();
+    for i in range(0, iterations):
+        advance(system, step_size);
+    return energy(system);
+
+setup = {
+    'input': lambda src: {'iterations': int(src['iterations']),
+                          'step-size': float(src['step-size'])},
+    'compute': lambda problem: run(problem['iterations'], problem['step-size']),
+    'output': lambda e: {'energy': float(e)}
+};
+
+# The energies printed by the Benchmarks Game for 1000 steps of 0.01
+def check():
+    system = solar_system();
+    e0 = energy(system);
+    for i in range(0, 1000):
+        advance(system, 0.01);
+    e1 = energy(system);
+    print('{:.9f}\n{:.9f}'.format(e0, e1));
+    return abs(e0 - -0.169075164) < 1.0e-9 and abs(e1 - -0.169087605) < 1.0e-9;
+
+def body_state(system, k):
+    return {'pos': system['pos'][k].tolist(),
+            'vel': system['vel'][k].tolist(),
+            'mass': float(system['mass'][k])};
+
+# Write every 'every'th state, 'count' of them, like nbody.main/save-state-seq
+def save_state_seq(filename, system, step_size, every, count):
+    with open(filename, 'w') as f:
+        f.write('[');
+        for i in range(0, count):
+            if 0 < i:
+                f.write(',');
+                for j in range(0, every):
+                    advance(system, step_size);
+            json.dump({k: body_state(system, n) for n, k in enumerate(system['names'])}, f);
+        f.write(']');
+
+def option(args, name, default):
+    if name in args:
+        return type(default)(args[args.index(name) + 1]);
+    return default;
+
+if __name__ == '__main__':
+    args = sys.argv[1:];
+    if '--check' in args:
+        sys.exit(0 if check() else 1);
+    elif '--stateseq' in args:
+        bodies = option(args, '--bodies', 5);
+        system = solar_system() if bodies == 5 else random_system(bodies);
+        save_state_seq(option(args, '--stateseq', ''), system,
+                       option(args, '--step-size', 0.01),
+                       option(args, '--every', 30),
+                       option(args, '--count', 40));
+    elif len(args) == 2:
+        bj.perform(setup, args[0], args[1]);
+    else:
+        print('Usage: nbody.py problem.json output.json');
+        sys.exit(1);
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import sys
+import numpy as np
+import bj
+
+# The tempexpr benchmark in NumPy: The covariance matrix of the vectors
+# stored one after the other in a flat array, the same as covarianceMatrix
+# in cpp/tempexpr.cpp. There are two modes:
+#
+#   naive  Every step of the expression in cpp/tempexpr.cpp is an array
+#          of its own: the reshaped data, the repeated mean, the centered
+#          data and its transpose.
+#   fused  The data is read through a view, without copying it, and the
+#          product is accumulated over chunks of vectors, so that the
+#          scratch memory is bounded by 'chunk_elements'.
+#
+# Usage:
+#   tempexpr.py [--mode naive|fused] problem.json output.json
+
+chunk_elements = 1 << 16;
+
+def covariance_naive(dim, data):
+    N = len(data)//dim;
+    X = np.array(data.reshape(N, dim).T);
+    mu = (np.ones((1, N)) @ X.T)/N;
+    mu_repeated = (np.ones((N, 1)) @ mu).T;
+    Xc = X - mu_repeated;
+    return (Xc @ Xc.T.copy())/(N - 1);
+
+def covariance_fused(dim, data):
+    N = len(data)//dim;
+    V = data.reshape(N, dim);
+    mu = V.sum(axis=0)/N;
+    rows = max(1, chunk_elements//dim);
+    dst = np.zeros((dim, dim));
+    scratch = np.empty((rows, dim));
+    for a in range(0, N, rows):
+        b = min(N, a + rows);
+        C = scratch[0:b - a];
+        np.subtract(V[a:b], mu, out=C);
+        dst += C.T @ C;
+    return dst/(N - 1);
+
+modes = {'naive': covariance_naive, 'fused': covariance_fused};
+
+def make_setup(mode):
+    covariance = modes[mode];
+    return {
+        'input': lambda src: {'dim': int(src['dim']),
+                              'data': np.asarray(src['data'], dtype=np.float64)},
+        'compute': lambda problem: covariance(problem['dim'], problem['data']),
+        'output': lambda C: C.tolist()
+    };
+
+def main(args, mode='naive'):
+    if '--mode' in args:
+        i = args.index('--mode');
+        mode = args[i + 1];
+        args = args[0:i] + args[i + 2:];
+    if len(args) != 2 or not(mode in modes):
+        print('Usage: tempexpr.py [--mode naive|fused] problem.json output.json');
+        return 1;
+    bj.perform(make_setup(mode), args[0], args[1]);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+import sys
+import tempexpr
+
+# tempexpr.py in the fused mode, for runners that take a single executable
+if __name__ == '__main__':
+    sys.exit(tempexpr.main(sys.argv[1:], 'fused'));
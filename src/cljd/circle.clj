@@ -678,7 +678,10 @@
                         ::benjmark/fn (benjmark/wrap-fn
                                        benchmark-java
                                        java-import
-                                       from-java-params)}}}))
+                                       from-java-params)}
+                "numpy" {::benjmark/name "NumPy"
+                         ::benjmark/fn
+                         (benjmark/wrap-executable "python/circleopt.py")}}}))
 
 (def sizes (benjmark/exponential-sizes 15 1000 1000000))
 
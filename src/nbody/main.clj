@@ -42,7 +42,10 @@
                        ::bj/fn
                        (bj/wrap-executable "cpp/nbody")}
                 "java" {::bj/name "Java"
-                        ::bj/fn (bj/wrap-fn nbody-java)}}}))
+                        ::bj/fn (bj/wrap-fn nbody-java)}
+                "numpy" {::bj/name "NumPy"
+                         ::bj/fn
+                         (bj/wrap-executable "python/nbody.py")}}}))
 
 (defn wrap-size [size]
   {:iterations size
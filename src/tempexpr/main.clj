@@ -57,7 +57,13 @@
                 "java" {::bj/name "Java"
                         ::bj/fn (bj/wrap-fn run-java
                                             input-java
-                                            output-java)}}}))
+                                            output-java)}
+                "numpy" {::bj/name "NumPy"
+                         ::bj/fn
+                         (bj/wrap-executable "python/tempexpr.py")}
+                "numpy-fused" {::bj/name "NumPy (fused)"
+                               ::bj/fn
+                               (bj/wrap-executable "python/tempexpr_fused.py")}}}))
 
 ;; (bj/generate-and-save-problems project generate-problem sizes)
 ;; (bj/run-benchmark project)